@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+
+"""
+Simple Slurm Tools
+Copyright (C) 2024 John Snowdon
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#####################################################################
+#
+# Single-pass grouped aggregation of slurm job records.
+#
+#####################################################################
+
+import heapq
+import math
+import random
+import tempfile
+from array import array
+
+# The metrics calculated for every job, and how to derive them from
+# a job record as returned by SlurmJob.set_rowsummary()
+METRICS = {
+	'runtime'	: lambda job: job['ElapsedTime'],
+	'waittime'	: lambda job: job['SubmitMinutes'],
+	'cores'		: lambda job: job['AllocCPUS'],
+	'nodes'		: lambda job: job['AllocNodes'],
+	'ramcore'	: lambda job: job['MemoryPerCore'],
+	'cpuhours'	: lambda job: (job['AllocCPUS'] * job['ElapsedTime']) / 60,
+}
+
+# Job fields which can be used to group jobs
+GROUP_KEYS = ['User', 'Account', 'Partition', 'QOS']
+
+# The name of the group which every job belongs to
+ALL = "all"
+
+# Bytes used by each value held for percentile calculations
+VALUE_SIZE = array('d').itemsize
+
+# Number of values read at a time from a spilled run
+SPILL_CHUNK = 65536
+
+# Spilled runs are merged into one once there are this many, which keeps
+# the number of open files, and the width of the final merge, bounded
+SPILL_RUNS_MAX = 16
+
+# Default number of jobs kept in each sample reservoir
+SAMPLE_SIZE = 10000
+
+# Normal distribution z-score for 95% confidence intervals
+CONFIDENCE_Z = 1.96
+
+def parse_groupby(groupby = ""):
+	""" Turn a comma seperated string of group keys into a list of group-by
+	dimensions. Keys joined with a '+' form a single composite dimension,
+	e.g. "Account,User+Partition" gives [('Account',), ('User', 'Partition')].
+	Unknown keys are discarded. """
+
+	dimensions = []
+	for dim in groupby.split(","):
+		keys = []
+		for key in dim.split("+"):
+			for k in GROUP_KEYS:
+				if key.strip().lower() == k.lower():
+					keys.append(k)
+		if keys and tuple(keys) not in dimensions:
+			dimensions.append(tuple(keys))
+	return dimensions
+
+def dimension_name(dimension = ()):
+	""" Printable name of a group-by dimension """
+	return "+".join(dimension)
+
+class JobAggregator():
+	""" Calculates the min/max/mean/total/percentile of every metric, for
+	every group of every group-by dimension, in a single pass over a
+	stream of jobs. """
+
+	def __init__(self, dimensions = [], percentile = 75, metrics = METRICS, memory_budget = None, temp_dir = None):
+		""" If a memory_budget (in bytes) is given, the values held for the
+		percentile calculations are spilled to sorted runs in temporary files
+		in temp_dir whenever they would exceed it, and merged back from
+		disk when the results are calculated. """
+		self.dimensions = dimensions
+		self.percentile = percentile
+		self.metrics = metrics
+		self.memory_budget = memory_budget
+		self.temp_dir = temp_dir
+		self.total_jobs = 0
+		self.values_held = 0
+		self.runs = []
+		self.group_list = []
+		self.overall = self.new_group()
+		self.groups = {}
+		for dim in self.dimensions:
+			self.groups[dim] = {}
+
+	def new_group(self):
+		""" Empty running totals for one group """
+		group = {
+			'id' : len(self.group_list),
+			'jobs' : 0,
+			'min' : {},
+			'max' : {},
+			'total' : {},
+			'values' : {},
+		}
+		for m in self.metrics:
+			group['min'][m] = None
+			group['max'][m] = None
+			group['total'][m] = 0
+			group['values'][m] = array('d')
+		self.group_list.append(group)
+		return group
+
+	def update_group(self, group = None, values = None):
+		""" Add the metric values of one job to a group """
+		group['jobs'] += 1
+		for m, v in values.items():
+			if group['min'][m] is None or v < group['min'][m]:
+				group['min'][m] = v
+			if group['max'][m] is None or v > group['max'][m]:
+				group['max'][m] = v
+			group['total'][m] += v
+			group['values'][m].append(v)
+
+	def group_key(self, job = None, dimension = ()):
+		""" The value of a job for a given group-by dimension """
+		if len(dimension) == 1:
+			return str(job.get(dimension[0], ""))
+		return "+".join(str(job.get(k, "")) for k in dimension)
+
+	def add(self, job = None):
+		""" Add one job to the overall totals and every group it belongs to """
+
+		values = {}
+		for m, f in self.metrics.items():
+			values[m] = f(job)
+
+		self.total_jobs += 1
+		self.update_group(self.overall, values)
+		for dim in self.dimensions:
+			key = self.group_key(job, dim)
+			if key not in self.groups[dim]:
+				self.groups[dim][key] = self.new_group()
+			self.update_group(self.groups[dim][key], values)
+
+		if self.memory_budget is not None:
+			self.values_held += len(values) * (len(self.dimensions) + 1)
+			if (self.values_held * VALUE_SIZE) > self.memory_budget:
+				self.spill()
+
+	def spill(self):
+		""" Write every value currently held in memory out to a new sorted
+		run on disk, recording where each group/metric segment starts. """
+
+		run = {
+			'file' : tempfile.TemporaryFile(dir = self.temp_dir),
+			'index' : {},
+		}
+		offset = 0
+		for group in self.group_list:
+			for m in self.metrics:
+				values = group['values'][m]
+				if len(values) > 0:
+					values = array('d', sorted(values))
+					values.tofile(run['file'])
+					run['index'][(group['id'], m)] = (offset, len(values))
+					offset += len(values)
+					group['values'][m] = array('d')
+		self.runs.append(run)
+		self.values_held = 0
+		if len(self.runs) >= SPILL_RUNS_MAX:
+			self.compact_runs()
+
+	def compact_runs(self):
+		""" Merge every spilled run into a single sorted run, segment by
+		segment, and close the files of the runs which were merged. """
+
+		merged = {
+			'file' : tempfile.TemporaryFile(dir = self.temp_dir),
+			'index' : {},
+		}
+		keys = set()
+		for run in self.runs:
+			keys.update(run['index'].keys())
+
+		offset = 0
+		for key in sorted(keys):
+			count = 0
+			chunk = array('d')
+			for v in heapq.merge(*[self.read_run(run, key) for run in self.runs]):
+				chunk.append(v)
+				if len(chunk) >= SPILL_CHUNK:
+					chunk.tofile(merged['file'])
+					count += len(chunk)
+					chunk = array('d')
+			chunk.tofile(merged['file'])
+			count += len(chunk)
+			merged['index'][key] = (offset, count)
+			offset += count
+
+		self.close()
+		self.runs = [merged]
+
+	def read_run(self, run = None, key = None):
+		""" Stream one sorted group/metric segment back from a spilled run """
+
+		offset, count = run['index'].get(key, (0, 0))
+		pos = 0
+		while pos < count:
+			n = min(SPILL_CHUNK, count - pos)
+			chunk = array('d')
+			run['file'].seek((offset + pos) * VALUE_SIZE)
+			chunk.fromfile(run['file'], n)
+			pos += n
+			for v in chunk:
+				yield v
+
+	def close(self):
+		""" Release any spilled runs """
+		for run in self.runs:
+			run['file'].close()
+		self.runs = []
+
+	def add_jobs(self, jobs = []):
+		""" Add a list (or any iterable) of jobs """
+		for job in jobs:
+			self.add(job)
+
+	def percentile_value(self, values = None, percentile = None):
+		""" The value at a given percentile of an unsorted list of values """
+		if percentile is None:
+			percentile = self.percentile
+		if len(values) == 0:
+			return 0
+		values = sorted(values)
+		idx = int(len(values) * (percentile / 100))
+		return values[min(idx, len(values) - 1)]
+
+	def group_percentile(self, group = None, metric = None):
+		""" The custom percentile of a metric for a group, merging the values
+		still in memory with any which have been spilled to disk """
+
+		if not self.runs:
+			return self.percentile_value(group['values'][metric])
+
+		idx = int(group['jobs'] * (self.percentile / 100))
+		idx = min(idx, group['jobs'] - 1)
+		streams = [sorted(group['values'][metric])]
+		for run in self.runs:
+			streams.append(self.read_run(run, (group['id'], metric)))
+		for i, v in enumerate(heapq.merge(*streams)):
+			if i == idx:
+				return v
+		return 0
+
+	def group_result(self, group = None):
+		""" Final min/max/mean/total/custom percentile figures for one group """
+
+		result = { 'jobs' : group['jobs'] }
+		for m in self.metrics:
+			r = { 'min' : 0, 'mean' : 0, 'max' : 0, 'total' : group['total'][m], 'custom' : 0 }
+			if group['jobs'] > 0:
+				r['min'] = group['min'][m]
+				r['max'] = group['max'][m]
+				r['mean'] = group['total'][m] / group['jobs']
+				r['custom'] = self.group_percentile(group, m)
+			result[m] = r
+		return result
+
+	def results(self):
+		""" Return the figures for the overall set of jobs, and for every
+		group of every dimension:
+			{
+				'all' : { 'jobs' : n, 'runtime' : { 'min', 'mean', 'max', 'total', 'custom' }, ... },
+				'by_group' : { ('User',) : { 'bob' : {...}, 'fred' : {...} }, ... },
+			}
+		"""
+
+		data = {
+			ALL : self.group_result(self.overall),
+			'by_group' : {},
+		}
+		for dim in self.dimensions:
+			data['by_group'][dim] = {}
+			for key, group in self.groups[dim].items():
+				data['by_group'][dim][key] = self.group_result(group)
+		return data
+
+class JobSampler():
+	""" Approximate version of JobAggregator which keeps a fixed size uniform
+	reservoir sample of jobs for the whole period and for every group,
+	however many jobs are streamed through it.
+
+	Rows are given as raw sacct lines and mapped into job records as they
+	arrive; rows which cannot be parsed are not counted at all. Job counts
+	are exact, everything else is estimated from the samples, with 95%
+	confidence intervals. """
+
+	def __init__(self, dimensions = [], percentile = 75, metrics = METRICS, parse_row = None, sample_size = SAMPLE_SIZE):
+		""" parse_row turns a raw row into a job record (or False). """
+		self.dimensions = dimensions
+		self.percentile = percentile
+		self.metrics = metrics
+		self.metric_names = list(metrics.keys())
+		self.parse_row = parse_row
+		self.sample_size = sample_size
+		self.total_jobs = 0
+		self.overall = self.new_reservoir()
+		self.groups = {}
+		for dim in self.dimensions:
+			self.groups[dim] = {}
+
+	def new_reservoir(self):
+		""" Empty sample reservoir for one group """
+		return {
+			'jobs' : 0,
+			'sample' : [],
+		}
+
+	def group_key(self, job = None, dimension = ()):
+		""" The value of a job for a given group-by dimension """
+		if len(dimension) == 1:
+			return str(job.get(dimension[0], ""))
+		return "+".join(str(job.get(k, "")) for k in dimension)
+
+	def add_row(self, line = None):
+		""" Offer one raw sacct row to the overall reservoir and to every group
+		reservoir it belongs to """
+
+		# Parse first, so a bad row leaves every counter untouched
+		job = self.parse_row(line)
+		if not job:
+			return
+		values = tuple(f(job) for f in self.metrics.values())
+
+		reservoirs = [self.overall]
+		for dim in self.dimensions:
+			key = self.group_key(job, dim)
+			if key not in self.groups[dim]:
+				self.groups[dim][key] = self.new_reservoir()
+			reservoirs.append(self.groups[dim][key])
+
+		self.total_jobs += 1
+		for r in reservoirs:
+			r['jobs'] += 1
+
+			# Algorithm R: the first sample_size rows are kept, after that
+			# each row replaces a random entry with probability k / n
+			if len(r['sample']) < self.sample_size:
+				r['sample'].append(values)
+			else:
+				slot = random.randrange(r['jobs'])
+				if slot < self.sample_size:
+					r['sample'][slot] = values
+
+	def add_rows(self, lines = []):
+		""" Add any iterable of raw sacct rows """
+		for line in lines:
+			self.add_row(line)
+
+	def reservoir_result(self, r = None):
+		""" Estimated min/max/mean/total/custom percentile figures for one
+		group, with confidence intervals for the mean, total and percentile """
+
+		n = r['jobs']
+		m = len(r['sample'])
+		result = { 'jobs' : n, 'sampled' : m }
+		for i, metric in enumerate(self.metric_names):
+			est = {
+				'min' : 0, 'mean' : 0, 'max' : 0, 'total' : 0, 'custom' : 0,
+				'mean_ci' : 0, 'total_ci' : 0, 'custom_low' : 0, 'custom_high' : 0,
+			}
+			if m > 0:
+				values = sorted(s[i] for s in r['sample'])
+				mean = sum(values) / m
+				est['min'] = values[0]
+				est['max'] = values[-1]
+				est['mean'] = mean
+				est['total'] = mean * n
+
+				# Standard error of the mean, with the finite population
+				# correction, which is zero once every job is in the sample
+				if m > 1 and n > 1:
+					variance = sum((v - mean) ** 2 for v in values) / (m - 1)
+					fpc = (n - m) / (n - 1)
+					est['mean_ci'] = CONFIDENCE_Z * math.sqrt((variance / m) * fpc)
+					est['total_ci'] = est['mean_ci'] * n
+
+				# Percentile, and the sample ranks bounding it at 95% confidence
+				p = self.percentile / 100
+				idx = min(int(m * p), m - 1)
+				est['custom'] = values[idx]
+				if m < n:
+					spread = CONFIDENCE_Z * math.sqrt(m * p * (1 - p))
+					est['custom_low'] = values[max(int(math.floor((m * p) - spread)), 0)]
+					est['custom_high'] = values[min(int(math.ceil((m * p) + spread)), m - 1)]
+				else:
+					est['custom_low'] = est['custom']
+					est['custom_high'] = est['custom']
+			result[metric] = est
+		return result
+
+	def results(self):
+		""" Return the estimated figures, in the same layout as JobAggregator.results() """
+
+		data = {
+			ALL : self.reservoir_result(self.overall),
+			'by_group' : {},
+		}
+		for dim in self.dimensions:
+			data['by_group'][dim] = {}
+			for key, r in self.groups[dim].items():
+				data['by_group'][dim][key] = self.reservoir_result(r)
+		return data
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+"""
+Simple Slurm Tools
+Copyright (C) 2024 John Snowdon
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#####################################################################
+#
+# Render day/week/month/year HTML report pages from slurm statistics.
+#
+# Each page records a hash of the names and modification times of the
+# per-day cache files it was built from, so a rebuild only loads,
+# summarises and renders the pages whose source days have changed
+# since the last build.
+#
+#####################################################################
+
+import datetime
+import hashlib
+import html
+import json
+import os
+import string
+
+import lib.settings as settings
+
+MANIFEST_FILE = "manifest.json"
+PAGE_TEMPLATE = "period.html"
+INDEX_TEMPLATE = "index.html"
+
+# Report period types and the settings which control their granularity
+PERIODS = {
+	'day' : { 'days' : settings.TODAY_DAYS, 'hours' : settings.TODAY_HOURS, 'minutes' : settings.TODAY_MINUTES },
+	'week' : { 'days' : settings.WEEK_DAYS, 'hours' : settings.WEEK_HOURS, 'minutes' : settings.WEEK_MINUTES },
+	'month' : { 'days' : settings.MONTH_DAYS, 'hours' : settings.MONTH_HOURS, 'minutes' : settings.MONTH_MINUTES },
+	'year' : { 'days' : settings.YEAR_DAYS, 'hours' : settings.YEAR_HOURS, 'minutes' : settings.YEAR_MINUTES },
+}
+
+# Summary figures shown on each page, as (label, key in summary['today'])
+TODAY_FIELDS = [
+	('Peak cores in use', 'use_max'),
+	('Peak cores in use (%)', 'use_max_pc'),
+	('Median cores in use', 'use_median'),
+	('Median cores in use (%)', 'use_median_pc'),
+	('Core fragmentation (%)', 'fragmentation_pc'),
+	('Most jobs running', 'jobs_running_max'),
+	('Most jobs pending', 'jobs_pending_max'),
+	('Jobs completed', 'jobs_completed_total'),
+	('Jobs failed', 'jobs_failed_total'),
+	('Median cores per job', 'cores_median'),
+	('Median memory per job (MB)', 'mem_job_median'),
+	('Median memory per core (MB)', 'mem_core_median'),
+	('Median CPU time per job', 'cpu_time_median'),
+]
+
+# League tables shown on each page, as (title, summary key, field)
+LEAGUE_TABLES = [
+	('Most jobs', 'top_jobs', 'total_jobs'),
+	('Most CPU time', 'top_cpu_time', 'total_cpu_time'),
+	('Most cores', 'top_cores', 'total_cores'),
+	('Most memory', 'top_memory', 'total_memory'),
+	('Most nodes', 'top_nodes', 'total_nodes'),
+]
+
+class HTMLReport():
+	""" Builds the HTML report pages for a run of report periods """
+
+	def __init__(self, stats = None, debug = settings.DEBUG, workers = settings.STATS_WORKERS):
+		""" stats is a SlurmStatsOLD instance used to generate and summarise
+		the statistics for each page, with up to 'workers' days generated
+		at once. """
+		self.stats = stats
+		self.debug = debug
+		self.workers = workers
+		self.manifest = {}
+
+	def page_name(self, period = "day", end_date = None):
+		""" Output filename for a given period type ending on a given date """
+		return f"{period}-{end_date.isoformat()}.html"
+
+	def hash_sources(self, files = []):
+		""" Hash the names and modification times of the per-day cache files
+		of a page, without reading them. Returns None if any day is not
+		cached yet, as the page then has to be built. """
+		data = ""
+		for f in files:
+			if not os.path.exists(f):
+				return None
+			data += f"{f}:{os.stat(f).st_mtime_ns}\n"
+		return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+	def hash_templates(self):
+		""" Hash the page templates, so that a template change rebuilds every page """
+		data = ""
+		for t in [PAGE_TEMPLATE, INDEX_TEMPLATE]:
+			with open(settings.TEMPLATE_PATH + "/" + t, 'r') as template_file:
+				data += template_file.read()
+		return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+	def load_manifest(self):
+		""" Load the page hashes recorded by the previous build """
+		manifest_filename = settings.HTML_PATH + "/" + MANIFEST_FILE
+		if os.path.exists(manifest_filename):
+			with open(manifest_filename, 'r') as manifest_file:
+				self.manifest = json.loads(manifest_file.read())
+		else:
+			self.manifest = {}
+		return self.manifest
+
+	def store_manifest(self):
+		""" Record the page hashes of this build """
+		manifest_filename = settings.HTML_PATH + "/" + MANIFEST_FILE
+		with open(manifest_filename, 'w') as manifest_file:
+			manifest_file.write(json.dumps(self.manifest, sort_keys = True))
+
+	def render_table(self, headings = [], rows = []):
+		""" Turn a list of rows into an HTML table """
+		text = "<table>\n<tr>"
+		for h in headings:
+			text += f"<th>{html.escape(str(h))}</th>"
+		text += "</tr>\n"
+		for row in rows:
+			text += "<tr>"
+			for v in row:
+				if isinstance(v, float):
+					v = f"{v:.1f}"
+				text += f"<td>{html.escape(str(v))}</td>"
+			text += "</tr>\n"
+		text += "</table>\n"
+		return text
+
+	def render_page(self, period = "day", start_date = None, end_date = None, summary = None):
+		""" Render one period page from a generate_summary() result """
+
+		today = summary['today']
+		rows = []
+		for label, key in TODAY_FIELDS:
+			if key in today:
+				rows.append([label, today[key]])
+		summary_table = self.render_table(['Metric', 'Value'], rows)
+
+		league_tables = ""
+		for title, key, field in LEAGUE_TABLES:
+			rows = []
+			for u in summary.get(key, []):
+				rows.append([u['user'], u[field]])
+			league_tables += f"<h3>{html.escape(title)}</h3>\n"
+			league_tables += self.render_table(['User', field], rows)
+
+		node_tables = ""
+		for title, key in [('Busiest nodes', 'busiest_nodes'), ('Idlest nodes', 'idlest_nodes')]:
+			rows = []
+			for n in summary.get(key, []):
+				rows.append([n['node'], n['utilisation_pc'], n['duty_cycle_pc'], n['cores_used_max']])
+			node_tables += f"<h3>{html.escape(title)}</h3>\n"
+			node_tables += self.render_table(['Node', 'Utilisation %', 'Duty cycle %', 'Peak cores'], rows)
+
+		with open(settings.TEMPLATE_PATH + "/" + PAGE_TEMPLATE, 'r') as template_file:
+			template = string.Template(template_file.read())
+
+		return template.safe_substitute(
+			title = html.escape(f"{period.capitalize()} report: {start_date} to {end_date}"),
+			period = html.escape(period),
+			start = html.escape(str(start_date)),
+			end = html.escape(str(end_date)),
+			generated = html.escape(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+			summary_table = summary_table,
+			league_tables = league_tables,
+			node_tables = node_tables,
+		)
+
+	def render_index(self):
+		""" Render the index page linking every page in the manifest """
+
+		links = ""
+		for period in PERIODS:
+			pages = sorted([p for p in self.manifest if p.startswith(period + "-")], reverse = True)
+			if pages:
+				links += f"<h2>{html.escape(period.capitalize())}</h2>\n<ul>\n"
+				for p in pages:
+					links += f"<li><a href=\"{html.escape(p)}\">{html.escape(p[len(period) + 1:-5])}</a></li>\n"
+				links += "</ul>\n"
+
+		with open(settings.TEMPLATE_PATH + "/" + INDEX_TEMPLATE, 'r') as template_file:
+			template = string.Template(template_file.read())
+
+		return template.safe_substitute(
+			generated = html.escape(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+			links = links,
+		)
+
+	def build_page(self, period = "day", end_date = None, template_hash = ""):
+		""" Build a single period page, if its source statistics have changed.
+		Returns True if the page was re-rendered. """
+
+		p = PERIODS[period]
+		name = self.page_name(period, end_date)
+		start_date = end_date - datetime.timedelta(days = p['days'] - 1)
+
+		# The page is unchanged if its days are all cached, and none of
+		# their cache files have been rewritten since the last build
+		files = self.stats.day_cache_files(end_date, p['days'], p['hours'], p['minutes'])
+		source_hash = self.hash_sources(files)
+		if source_hash and self.manifest.get(name) == template_hash + "-" + source_hash and os.path.exists(settings.HTML_PATH + "/" + name):
+			if self.debug:
+				print(f"- {name} unchanged")
+			return False
+
+		# Per-day statistics come from the persistent cache where possible
+		if self.debug:
+			print(f"- Rendering {name}")
+		stats = self.stats.generate_stats_days(end_date = end_date, days = p['days'], hours = p['hours'], minutes = p['minutes'], workers = self.workers)
+		summary = self.stats.generate_summary(stats)
+		page = self.render_page(period, start_date, end_date, summary)
+		with open(settings.HTML_PATH + "/" + name, 'w') as page_file:
+			page_file.write(page)
+
+		# Days generated by this build are now cached; a page with a day
+		# which cannot be cached yet (today) is built every time
+		source_hash = self.hash_sources(files)
+		if source_hash:
+			self.manifest[name] = template_hash + "-" + source_hash
+		else:
+			self.manifest[name] = None
+		return True
+
+	def build(self, end_date = None, days = settings.WEEK_DAYS, force = False):
+		""" Build the day pages for the last 'days' days, and the week, month
+		and year pages ending on end_date (default yesterday), followed by the
+		index. Only pages whose source periods changed are re-rendered,
+		unless force is set. Returns the list of page names which were
+		rendered. """
+
+		if end_date is None:
+			end_date = datetime.date.today() - datetime.timedelta(days = 1)
+
+		if not os.path.exists(settings.HTML_PATH):
+			os.makedirs(settings.HTML_PATH)
+
+		self.load_manifest()
+		if force:
+			self.manifest = {}
+		template_hash = self.hash_templates()
+
+		pages = []
+		for i in range(0, days):
+			pages.append(('day', end_date - datetime.timedelta(days = i)))
+		for period in ['week', 'month', 'year']:
+			pages.append((period, end_date))
+
+		rendered = []
+		for period, page_date in pages:
+			if self.build_page(period, page_date, template_hash):
+				rendered.append(self.page_name(period, page_date))
+
+		if rendered or not os.path.exists(settings.HTML_PATH + "/index.html"):
+			with open(settings.HTML_PATH + "/index.html", 'w') as index_file:
+				index_file.write(self.render_index())
+		self.store_manifest()
+
+		return rendered
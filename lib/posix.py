@@ -18,10 +18,23 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import bisect
+import concurrent.futures
 import grp
+import gzip
+import hashlib
+import heapq
+import json
+import mmap
 import pwd
 import os
+import queue
+import stat
 import subprocess
+import threading
+import time
+
+import lib.settings as settings
 
 ####################################################################
 #
@@ -32,56 +45,157 @@ import subprocess
 AUTHOR		= "John Snowdon"
 URL			= "https://github.com/megatron-uk/Simple-Slurm-Tools"
 
+# Bump if the layout of the persistent scan index changes
+SCAN_INDEX_VERSION = 1
+
+# Bytes of an inventory file decoded at a time; bounds the memory used
+INVENTORY_CHUNK = 64 * 1024 * 1024
+
+# Users and groups, read once per run by get_directory()
+DIRECTORY	= None
+
+def get_directory(refresh = False):
+	""" Enumerate every user and group once, with getpwall() and getgrall(),
+	into indexed maps. Later lookups are dictionary reads rather than a
+	getent, or an LDAP query, each. """
+
+	# Returns the following structure
+	#DIRECTORY = {
+	#	'uid_name' : { 1000 : 'bob' },
+	#	'name_uid' : { 'bob' : 1000 },
+	#	'gid_name' : { 100 : 'users' },
+	#	'name_gid' : { 'users' : 100 },
+	#	'group_members' : { 'users' : ['bob', 'fred'] },	# including primary group members
+	#	'user_groups' : { 'bob' : ['users', 'team1'] },		# including the primary group
+	#}
+	global DIRECTORY
+
+	if DIRECTORY is not None and refresh is False:
+		return DIRECTORY
+
+	directory = {
+		'uid_name' : {},
+		'name_uid' : {},
+		'gid_name' : {},
+		'name_gid' : {},
+		'group_members' : {},
+		'user_groups' : {},
+	}
+
+	try:
+		for g in grp.getgrall():
+			directory['gid_name'][g.gr_gid] = g.gr_name
+			directory['name_gid'][g.gr_name] = g.gr_gid
+			directory['group_members'][g.gr_name] = list(g.gr_mem)
+			for user in g.gr_mem:
+				if user not in directory['user_groups']:
+					directory['user_groups'][user] = []
+				directory['user_groups'][user].append(g.gr_name)
+
+		for u in pwd.getpwall():
+			directory['uid_name'][u.pw_uid] = u.pw_name
+			directory['name_uid'][u.pw_name] = u.pw_uid
+			if u.pw_name not in directory['user_groups']:
+				directory['user_groups'][u.pw_name] = []
+
+			# Members by primary group are not listed in the group entry
+			if u.pw_gid in directory['gid_name']:
+				group = directory['gid_name'][u.pw_gid]
+				if u.pw_name not in directory['group_members'][group]:
+					directory['group_members'][group].append(u.pw_name)
+				if group not in directory['user_groups'][u.pw_name]:
+					directory['user_groups'][u.pw_name].append(group)
+	except Exception as err:
+		print("ERROR (get_directory): %s" % err)
+
+	DIRECTORY = directory
+	return DIRECTORY
+
+def get_uid(user_name = "myname"):
+	""" Map a username to a uid, or None if it is not a real user """
+
+	directory = get_directory()
+	if user_name not in directory['name_uid']:
+		# Not every directory service allows users to be enumerated
+		try:
+			u = pwd.getpwnam(user_name)
+			directory['name_uid'][u.pw_name] = u.pw_uid
+			directory['uid_name'][u.pw_uid] = u.pw_name
+		except KeyError:
+			return None
+	return directory['name_uid'][user_name]
+
+def get_gid(group_name = "mygroup"):
+	""" Map a group name to a gid, or None if it is not a real group """
+
+	directory = get_directory()
+	if group_name not in directory['name_gid']:
+		try:
+			g = grp.getgrnam(group_name)
+			directory['name_gid'][g.gr_name] = g.gr_gid
+			directory['gid_name'][g.gr_gid] = g.gr_name
+			directory['group_members'][g.gr_name] = list(g.gr_mem)
+		except KeyError:
+			return None
+	return directory['name_gid'][group_name]
+
+def get_username(uid = 0):
+	""" Map a uid to a username, or "" if the uid no longer has a user """
+
+	directory = get_directory()
+	if uid not in directory['uid_name']:
+		try:
+			directory['uid_name'][uid] = pwd.getpwuid(uid).pw_name
+		except KeyError:
+			# Remember misses too; orphaned files often share a few dead uids
+			directory['uid_name'][uid] = ""
+	return directory['uid_name'][uid]
+
+def get_groupname(gid = 0):
+	""" Map a gid to a group name, or "" if the gid no longer has a group """
+
+	directory = get_directory()
+	if gid not in directory['gid_name']:
+		try:
+			directory['gid_name'][gid] = grp.getgrgid(gid).gr_name
+		except KeyError:
+			directory['gid_name'][gid] = ""
+	return directory['gid_name'][gid]
+
 def get_groups(groups = None):
 	""" Turn a comma seperated string of group names into a list of real unix group names. """
 	groupnames = []
 	for group in groups.split(","):
+		group = group.strip()
 		if len(group) > 1:
-			try:
-				# Is this a valid posix group?
-				grpstruct = grp.getgrnam(group.lstrip().rstrip())
-				groupnames.append(grpstruct.gr_name)	
-			except Exception as err:
-				pass
+			# Is this a valid posix group?
+			if get_gid(group) is not None:
+				groupnames.append(group)
 	return groupnames
 
 def get_users(users = None):
 	""" Turn a comma seperated string of usernames into a list of usernames. """
 	usernames = []
 	for user in users.split(","):
+		user = user.strip()
 		if len(user) > 1:
-			try:
-				# Is this a valid posix username?
-				usrstruct = pwd.getpwnam(user.lstrip().rstrip())
-				usernames.append(usrstruct.pw_name)
-			except Exception as err:
-				pass
+			# Is this a valid posix username?
+			if get_uid(user) is not None:
+				usernames.append(user)
 	return usernames
 
 def get_users_from_groups(groups = []):
-	""" Get a list of usernames from a group list """
+	""" Get a list of usernames from a group list, including the users whose
+	primary group is one of the groups """
+	directory = get_directory()
 	usernames = []
 	for group in groups:
-		if group:
-			job_cmd = "getent group %s | awk -F: \'{print $4}\'" % group
-			try:
-				process = subprocess.Popen(job_cmd, shell=True,
-						stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-						stderr=subprocess.STDOUT)
-				if process:
-					output = process.stdout.read().rstrip().split(b'\n')
-					if len(output) > 0:
-						for line in output:
-							line = line.decode()
-							line = line.replace(';', ',')
-							users = get_users(line)
-							for user in users:
-								if user not in usernames:
-									usernames.append(user)
-			except Exception as err:
-				pass
+		if group and get_gid(group) is not None:
+			for user in directory['group_members'].get(group, []):
+				if user not in usernames and get_uid(user) is not None:
+					usernames.append(user)
 	return usernames
-	
+
 def get_user_quota(find_type = "normal", user_name = "myname", quota_directory = "/mydir"):
 	""" Get quota details for a given username and mount point """
 	
@@ -190,6 +304,1242 @@ def get_group_quota(find_type = "normal", group_name = "mygroup", quota_director
 		print("ERROR (get_group_quota): %s" % err)
 		return False
 
+def set_quota_fields(data = None, used = "0", limit = "0"):
+	""" Set the quota and limit of a quota result dict from the text of the
+	used and limit columns, either of which may carry an over-quota '*' """
+
+	if '*' in used:
+		data['quota'] = int(used.split('*')[0])
+		data['overquota'] = True
+	else:
+		data['quota'] = int(used)
+	if '*' in limit:
+		data['limit'] = int(limit.split('*')[0])
+		data['overquota'] = True
+	else:
+		data['limit'] = int(limit)
+	return data
+
+def decode_repquota(repquota_output = b"", by_group = False, quota_directory = "/mydir"):
+	""" Decode the output of repquota into a dict of quota results, keyed by
+	user or group name, in the same form as get_user_quota()/get_group_quota() """
+
+	# Example output
+	#
+	#*** Report for user quotas on device /dev/sdb1
+	#Block grace time: 7days; Inode grace time: 7days
+	#                        Block limits                File limits
+	#User            used    soft    hard  grace    used  soft  hard  grace
+	#----------------------------------------------------------------------
+	#root      --      20       0       0              2     0     0
+	#bob       +-  900000  800000 1000000  6days     100     0     0
+
+	if by_group:
+		name_field = 'group'
+	else:
+		name_field = 'username'
+
+	quotas = {}
+	for line in repquota_output.split(b'\n'):
+		try:
+			fields = line.decode().split()
+			# Only entries have a two character limit flags column
+			if len(fields) < 5 or len(fields[1]) != 2 or fields[1][0] not in "+-":
+				continue
+			data = {
+				name_field	: fields[0],
+				'dirname'	: quota_directory,
+				'quota'		: 0,
+				'limit'		: 0,
+				'overquota'	: fields[1][0] == '+',
+			}
+			set_quota_fields(data, fields[2], fields[3])
+			quotas[fields[0]] = data
+		except Exception as err:
+			print("ERROR (decode_repquota): %s" % err)
+	return quotas
+
+def decode_lfs_quota(lfs_output = b"", data = None):
+	""" Set the quota and limit of a quota result dict from the output of
+	lfs quota -q """
+
+	# Example output; a long filesystem path is wrapped onto its own line
+	#
+	#/lustre        1234*   1000    2000       -      12       0       0       -
+	#/a/much/longer/lustre/path
+	#               1234    1000    2000       -      12       0       0       -
+	#
+	# Filesystem kbytes quota limit grace files quota limit grace
+
+	fields = []
+	for line in lfs_output.decode().split('\n'):
+		fields += line.split()
+		if len(fields) == 1:
+			# Only the path; the figures follow on the next line
+			continue
+		numeric = [f for f in fields if f.rstrip('*').isdigit()]
+		if len(numeric) >= 6:
+			set_quota_fields(data, numeric[0], numeric[1])
+			return data
+		fields = []
+	return data
+
+def get_lfs_quota(by_group = False, name = "myname", quota_directory = "/mydir"):
+	""" Get the Lustre quota of a single user or group, for get_quotas_bulk() """
+
+	if by_group:
+		job_cmd = ["lfs", "quota", "-q", "-g", name, quota_directory]
+		data = { 'group' : name }
+	else:
+		job_cmd = ["lfs", "quota", "-q", "-u", name, quota_directory]
+		data = { 'username' : name }
+	data.update({ 'dirname' : quota_directory, 'quota' : 0, 'limit' : 0, 'overquota' : False })
+
+	try:
+		process = subprocess.run(job_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		return decode_lfs_quota(process.stdout, data)
+	except Exception as err:
+		print("ERROR (get_lfs_quota): %s" % err)
+		return False
+
+def get_quotas_bulk(find_type = "normal", by_group = False, quota_directory = "/mydir", names = None, workers = 8):
+	""" Get the quota of every user (or group, if by_group) on a filesystem
+	at once, rather than one quota call per name. For normal quotas this is
+	a single repquota call. Lustre has no repquota, so one lfs quota call
+	per name is run, 'workers' at a time. If names is given, only those
+	users or groups are returned, otherwise everyone is.
+	Returns a dict of quota results keyed by name, or False on error. """
+
+	if find_type == "lfs":
+		if not names:
+			if by_group:
+				names = list(get_directory()['name_gid'].keys())
+			else:
+				names = list(get_directory()['name_uid'].keys())
+		quotas = {}
+		with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+			for name, data in zip(names, executor.map(lambda n: get_lfs_quota(by_group, n, quota_directory), names)):
+				if data:
+					quotas[name] = data
+		return quotas
+
+	if by_group:
+		job_cmd = ["repquota", "-g", quota_directory]
+	else:
+		job_cmd = ["repquota", "-u", quota_directory]
+
+	try:
+		process = subprocess.run(job_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		if process.returncode != 0:
+			return False
+	except Exception as err:
+		print("ERROR (get_quotas_bulk): %s" % err)
+		return False
+
+	quotas = decode_repquota(process.stdout, by_group, quota_directory)
+	if names:
+		wanted = {}
+		for name in names:
+			if name in quotas:
+				wanted[name] = quotas[name]
+		quotas = wanted
+	return quotas
+
+def walk_dirs(quota_directory = "/mydir", new_state = None, process_dir = None, workers = 1):
+	""" Visit every directory of a tree, calling process_dir(state, dir_name),
+	which returns the list of subdirectories to visit next. Each worker
+	thread keeps its own state, from new_state(), and takes directories from
+	a shared queue, so a slow metadata server is kept busy with several
+	requests at once. Returns the list of worker states. An exception
+	raised by process_dir() is raised again once the other workers have
+	finished. """
+
+	if workers <= 1:
+		state = new_state()
+		dirs = [quota_directory]
+		while dirs:
+			dirs += process_dir(state, dirs.pop())
+		return [state]
+
+	work = queue.Queue()
+
+	def worker(state, failed):
+		while True:
+			dir_name = work.get()
+			if dir_name is None:
+				work.task_done()
+				return
+			try:
+				for d in process_dir(state, dir_name):
+					work.put(d)
+			except Exception as err:
+				# Keep the worker running, so the rest of the queue is still
+				# taken and work.join() returns; the error is raised below
+				failed.append(err)
+			finally:
+				work.task_done()
+
+	states = []
+	failures = []
+	threads = []
+	for i in range(workers):
+		states.append(new_state())
+		failures.append([])
+		t = threading.Thread(target = worker, args = (states[i], failures[i]), daemon = True)
+		t.start()
+		threads.append(t)
+
+	# Every directory is queued before its parent is marked as done, so the
+	# queue only empties once the whole tree has been walked
+	work.put(quota_directory)
+	work.join()
+	for t in threads:
+		work.put(None)
+	for t in threads:
+		t.join()
+
+	# As with a single worker, an exception from process_dir() is raised
+	# to the caller, once the walk has finished
+	for failed in failures:
+		if failed:
+			raise failed[0]
+
+	return states
+
+def walk_tree(quota_directory = "/mydir", new_totals = None, visit = None, merge = None, workers = 1):
+	""" Walk a directory tree once, without following symbolic links, calling
+	visit(totals, path, st) for the top level directory and every entry below
+	it. Each worker keeps its own totals, from new_totals(), which are
+	combined with merge(totals, other) at the end; see walk_dirs().
+	Errors are counted in totals['errors']. """
+
+	totals = new_totals()
+
+	# The top level directory is counted too, as find would
+	try:
+		visit(totals, quota_directory, os.stat(quota_directory, follow_symlinks = False))
+	except OSError:
+		totals['errors'] += 1
+		return totals
+
+	def scan_dir(worker_totals, dir_name):
+		subdirs = []
+		try:
+			with os.scandir(dir_name) as it:
+				for entry in it:
+					try:
+						st = entry.stat(follow_symlinks = False)
+					except OSError:
+						worker_totals['errors'] += 1
+						continue
+					visit(worker_totals, entry.path, st)
+					if stat.S_ISDIR(st.st_mode):
+						subdirs.append(entry.path)
+		except OSError:
+			# Unreadable directory, or it was removed during the walk
+			worker_totals['errors'] += 1
+		return subdirs
+
+	for w in walk_dirs(quota_directory, new_totals, scan_dir, workers):
+		merge(totals, w)
+	return totals
+
+def scan_index_filename(quota_directory = "/mydir"):
+	""" Name of the persistent scan index of a directory tree """
+
+	key = hashlib.md5(os.path.realpath(quota_directory).encode('utf-8')).hexdigest()
+	return settings.CACHE_PATH + "/scanindex-" + key + ".json.gz"
+
+def load_scan_index(quota_directory = "/mydir"):
+	""" Load the per-directory totals recorded by the last indexed scan of a
+	tree, or an empty index if there is none """
+
+	index_filename = scan_index_filename(quota_directory)
+	try:
+		with gzip.open(index_filename, 'rt') as index_file:
+			index = json.loads(index_file.read())
+		if index.get('version') == SCAN_INDEX_VERSION:
+			return index['dirs']
+	except (OSError, ValueError):
+		pass
+	return {}
+
+def store_scan_index(quota_directory = "/mydir", dirs = None):
+	""" Record the per-directory totals of an indexed scan """
+
+	if not os.path.exists(settings.CACHE_PATH):
+		os.makedirs(settings.CACHE_PATH)
+	index_filename = scan_index_filename(quota_directory)
+	with gzip.open(index_filename + ".tmp", 'wt') as index_file:
+		index_file.write(json.dumps({ 'version' : SCAN_INDEX_VERSION, 'dirname' : quota_directory, 'dirs' : dirs }))
+	os.replace(index_filename + ".tmp", index_filename)
+
+def scan_utilisation_indexed(quota_directory = "/mydir", verbose = False, workers = 1, tree_depth = 0):
+	""" As scan_utilisation(), but using the persistent scan index. The index
+	holds, for every directory, its mtime and the totals by uid and gid of
+	the entries directly inside it. A directory whose mtime has not changed
+	since the last scan is not listed again and none of its files are
+	stat'ed; its recorded totals and subdirectories are reused. Only the
+	directories themselves are stat'ed to check their mtime.
+
+	NOTE: a directory's mtime only changes when entries are added, removed or
+	renamed. Files which grow or change owner in place are not seen until
+	their directory changes, or the index is removed. """
+
+	old_dirs = load_scan_index(quota_directory)
+	scan_start = time.time_ns()
+
+	def new_state():
+		return { 'dirs' : {}, 'errors' : 0, 'reused' : 0, 'rescanned' : 0 }
+
+	def process_dir(state, dir_name):
+		try:
+			dir_st = os.stat(dir_name, follow_symlinks = False)
+		except OSError:
+			state['errors'] += 1
+			return []
+
+		old = old_dirs.get(dir_name)
+		if old and old['mtime'] == dir_st.st_mtime_ns:
+			state['dirs'][dir_name] = old
+			state['reused'] += 1
+			return old['subdirs']
+
+		# Don't trust the mtime of a directory which is changing as we scan it
+		mtime = dir_st.st_mtime_ns
+		if mtime >= scan_start - 1000000000:
+			mtime = 0
+		entry = { 'mtime' : mtime, 'users' : {}, 'groups' : {}, 'subdirs' : [] }
+		try:
+			with os.scandir(dir_name) as it:
+				for e in it:
+					try:
+						st = e.stat(follow_symlinks = False)
+					except OSError:
+						state['errors'] += 1
+						continue
+					blocks = st.st_blocks * 512
+					for key, i in [('users', str(st.st_uid)), ('groups', str(st.st_gid))]:
+						if i not in entry[key]:
+							entry[key][i] = [0, 0, 0]
+						t = entry[key][i]
+						t[0] += st.st_size
+						t[1] += blocks
+						t[2] += 1
+					if stat.S_ISDIR(st.st_mode):
+						entry['subdirs'].append(e.path)
+		except OSError:
+			# Unreadable directory; don't record it, so it is tried again
+			state['errors'] += 1
+			return []
+
+		state['dirs'][dir_name] = entry
+		state['rescanned'] += 1
+		return entry['subdirs']
+
+	# File ages change without their directory changing, so an indexed
+	# scan has no age histograms
+	data = {
+		'dirname' : quota_directory,
+		'users' : {},
+		'groups' : {},
+		'user_ages' : {},
+		'group_ages' : {},
+		'age_buckets' : None,
+		'tree' : {},
+		'tree_depth' : tree_depth,
+		'bytes' : 0,
+		'blocks' : 0,
+		'files' : 0,
+		'errors' : 0,
+		'dirs_reused' : 0,
+		'dirs_rescanned' : 0,
+	}
+
+	def add(key, i, size, blocks, files):
+		if i not in data[key]:
+			data[key][i] = new_scan_totals()
+		t = data[key][i]
+		t['bytes'] += size
+		t['blocks'] += blocks
+		t['files'] += files
+
+	# The top level directory is counted too, as find would
+	try:
+		st = os.stat(quota_directory, follow_symlinks = False)
+	except OSError:
+		data['errors'] += 1
+		return data
+	add('users', st.st_uid, st.st_size, st.st_blocks * 512, 1)
+	add('groups', st.st_gid, st.st_size, st.st_blocks * 512, 1)
+	data['bytes'] += st.st_size
+	data['blocks'] += st.st_blocks * 512
+	data['files'] += 1
+
+	dirs = {}
+	for state in walk_dirs(quota_directory, new_state, process_dir, workers):
+		dirs.update(state['dirs'])
+		data['errors'] += state['errors']
+		data['dirs_reused'] += state['reused']
+		data['dirs_rescanned'] += state['rescanned']
+
+	for dir_name, entry in dirs.items():
+		if tree_depth:
+			rollup = tree_dirs(quota_directory, dir_name, tree_depth)
+		for key in ['users', 'groups']:
+			for i, t in entry[key].items():
+				add(key, int(i), t[0], t[1], t[2])
+				if tree_depth:
+					add_tree(data['tree'], rollup, key, int(i), t[0], t[1], t[2])
+		for t in entry['users'].values():
+			data['bytes'] += t[0]
+			data['blocks'] += t[1]
+			data['files'] += t[2]
+
+	# Directories no longer in the tree are dropped from the index
+	store_scan_index(quota_directory, dirs)
+
+	if verbose:
+		print(f"- {data['dirs_rescanned']} directories scanned, {data['dirs_reused']} unchanged")
+
+	return data
+
+def new_age_totals(age_buckets = settings.AGE_BUCKETS):
+	""" An empty age histogram; files and bytes by the age of their last
+	modification and last access, in len(age_buckets) + 1 buckets """
+	n = len(age_buckets) + 1
+	return { 'mtime_files' : [0] * n, 'mtime_bytes' : [0] * n, 'atime_files' : [0] * n, 'atime_bytes' : [0] * n }
+
+def add_age(ages = None, st = None, now = 0, age_buckets = settings.AGE_BUCKETS):
+	""" Add one file to an age histogram """
+	add_age_times(ages, st.st_mtime, st.st_atime, st.st_size, now, age_buckets)
+
+def add_age_times(ages = None, mtime = 0, atime = 0, size = 0, now = 0, age_buckets = settings.AGE_BUCKETS):
+	""" Add one file, by its times and size, to an age histogram """
+	i = bisect.bisect_right(age_buckets, (now - mtime) / 86400)
+	ages['mtime_files'][i] += 1
+	ages['mtime_bytes'][i] += size
+	i = bisect.bisect_right(age_buckets, (now - atime) / 86400)
+	ages['atime_files'][i] += 1
+	ages['atime_bytes'][i] += size
+
+def merge_ages(ages = None, other = None):
+	""" Add one age histogram to another """
+	for field in ages:
+		for i in range(len(ages[field])):
+			ages[field][i] += other[field][i]
+
+def age_labels(age_buckets = settings.AGE_BUCKETS):
+	""" Names of the age buckets, e.g. ['<30d', '30d-180d', '180d-1y', '>1y'] """
+
+	def days(d):
+		if d % 365 == 0:
+			return f"{d // 365}y"
+		return f"{d}d"
+
+	labels = [f"<{days(age_buckets[0])}"]
+	for i in range(1, len(age_buckets)):
+		labels.append(f"{days(age_buckets[i - 1])}-{days(age_buckets[i])}")
+	labels.append(f">{days(age_buckets[-1])}")
+	return labels
+
+def age_report(ages = None, age_buckets = settings.AGE_BUCKETS):
+	""" Turn an age histogram into a list of buckets for reports:
+		{ 'mtime' : [ { 'bucket' : '<30d', 'files' : 12, 'kbytes' : 345 }, ... ], 'atime' : [...] }
+	"""
+	report = { 'mtime' : [], 'atime' : [] }
+	labels = age_labels(age_buckets)
+	for t in ['mtime', 'atime']:
+		for i in range(len(labels)):
+			report[t].append({ 'bucket' : labels[i], 'files' : ages[t + '_files'][i], 'kbytes' : int(ages[t + '_bytes'][i] / 1024) })
+	return report
+
+def new_file_list(top_n = settings.TOP_FILES):
+	""" A count of matching files, keeping only the top_n largest as a
+	heap of (bytes, path), so memory does not grow with the tree """
+	return { 'count' : 0, 'bytes' : 0, 'top_n' : top_n, 'largest' : [] }
+
+def add_largest(files = None, size = 0, path = ""):
+	""" Offer one file to the heap of the largest files """
+	if len(files['largest']) < files['top_n']:
+		heapq.heappush(files['largest'], (size, path))
+	elif files['top_n'] > 0 and size > files['largest'][0][0]:
+		heapq.heapreplace(files['largest'], (size, path))
+
+def add_file(files = None, size = 0, path = ""):
+	""" Count one matching file """
+	files['count'] += 1
+	files['bytes'] += size
+	add_largest(files, size, path)
+
+def merge_file_lists(files = None, other = None):
+	""" Add one file list to another """
+	files['count'] += other['count']
+	files['bytes'] += other['bytes']
+	for size, path in other['largest']:
+		add_largest(files, size, path)
+
+def largest_files(files = None):
+	""" The largest files of a file list, biggest first:
+		[ { 'file' : '/a/big/file', 'kbytes' : 12345 }, ... ]
+	"""
+	largest = []
+	for size, path in sorted(files['largest'], reverse = True):
+		largest.append({ 'file' : path, 'kbytes' : int(size / 1024) })
+	return largest
+
+def open_manifest(filename = ""):
+	""" Open a gzip compressed file manifest, which the walk writes every
+	matching path to, one per line, as it goes. Several worker threads may
+	write to the same manifest. """
+	try:
+		return {
+			'filename' : filename,
+			'file' : gzip.open(filename, 'wt', encoding = 'utf-8', errors = 'surrogateescape'),
+			'lock' : threading.Lock(),
+			'count' : 0,
+		}
+	except Exception as err:
+		print("ERROR (open_manifest): %s" % err)
+		return None
+
+def write_manifest(manifest = None, paths = None):
+	""" Write a batch of paths to a manifest, and empty the batch """
+	if manifest and paths:
+		with manifest['lock']:
+			manifest['file'].write("\n".join(paths) + "\n")
+			manifest['count'] += len(paths)
+	if paths:
+		paths.clear()
+
+def close_manifest(manifest = None):
+	""" Close a manifest, returning its filename, or None if there was none """
+	if not manifest:
+		return None
+	manifest['file'].close()
+	return manifest['filename']
+
+def tree_dirs(root = "", dir_name = "", depth = 0):
+	""" The directories, no more than depth levels below root, which hold
+	the entries of dir_name (dir_name itself included), relative to root.
+	e.g. root '/data', dir_name '/data/a/b/c' and depth 2 gives ['a', 'a/b'].
+	Works on str or bytes paths. """
+
+	rel = dir_name[len(root):]
+	if isinstance(rel, str):
+		sep = '/'
+	else:
+		sep = b'/'
+	rel = rel.strip(sep)
+	if not rel:
+		return []
+	parts = rel.split(sep, depth)
+	dirs = []
+	for i in range(1, min(depth, len(parts)) + 1):
+		dirs.append(sep.join(parts[:i]))
+	return dirs
+
+def add_tree(tree = None, dirs = None, key = "users", owner = 0, size = 0, blocks = 0, files = 1):
+	""" Add the space used by an owner to each of a list of directories.
+	The tree holds { dir : { 'users' : { uid : [bytes, blocks, files] }, 'groups' : {...} } },
+	so it grows with the number of directories and owners, not files. """
+	for d in dirs:
+		if d not in tree:
+			tree[d] = { 'users' : {}, 'groups' : {} }
+		owners = tree[d][key]
+		if owner not in owners:
+			owners[owner] = [0, 0, 0]
+		t = owners[owner]
+		t[0] += size
+		t[1] += blocks
+		t[2] += files
+
+def merge_tree(tree = None, other = None):
+	""" Add one directory tree rollup to another """
+	for d, o in other.items():
+		for key in ['users', 'groups']:
+			for owner, t in o[key].items():
+				add_tree(tree, [d], key, owner, t[0], t[1], t[2])
+
+def tree_report(scan = None, key = "users", owner = 0, allocated = False, top_k = settings.TREE_TOP):
+	""" The top_k directories of a scan's tree rollup holding the most data,
+	and the most files, of one uid (key 'users') or gid (key 'groups'):
+		{ 'depth' : 2, 'by_size' : [ { 'dir', 'kbytes', 'files' } ], 'by_files' : [...] }
+	"""
+	if allocated:
+		field = 1
+	else:
+		field = 0
+	dirs = []
+	for d, o in scan['tree'].items():
+		if owner in o[key]:
+			t = o[key][owner]
+			dirs.append({ 'dir' : os.path.join(scan['dirname'], d), 'kbytes' : int(t[field] / 1024), 'files' : t[2] })
+	return {
+		'depth' : scan['tree_depth'],
+		'by_size' : heapq.nlargest(top_k, dirs, key = lambda x: x['kbytes']),
+		'by_files' : heapq.nlargest(top_k, dirs, key = lambda x: x['files']),
+	}
+
+def new_scan_totals():
+	""" An empty set of scan totals for one uid or gid """
+	return { 'bytes' : 0, 'blocks' : 0, 'files' : 0 }
+
+def scan_utilisation(quota_directory = "/mydir", verbose = False, workers = 1, index = False, tree_depth = 0):
+	""" Walk a directory tree once, using os.scandir, and total the space
+	used by every uid and every gid in the same pass. Replaces one find or
+	ls walk of the tree per user or group. Several worker threads may be
+	used; see walk_tree(). If index is set, directories which have not
+	changed since the last scan are not walked again; see
+	scan_utilisation_indexed(). If tree_depth is set, the space used by
+	each uid and gid is also rolled up to every directory in the first
+	tree_depth levels of the tree, as du would; see add_tree(). """
+
+	# Returns the following structure, 'blocks' being allocated bytes. The
+	# age histograms of files (not directories), see new_age_totals(), are
+	# gathered in the same pass, but not by an indexed scan.
+	#data = {
+	#	'dirname' : '/mydir',
+	#	'users' : { uid : { 'bytes' : 12345, 'blocks' : 16384, 'files' : 2 } },
+	#	'groups' : { gid : { 'bytes' : 12345, 'blocks' : 16384, 'files' : 2 } },
+	#	'user_ages' : { uid : { 'mtime_files' : [...], ... } },
+	#	'group_ages' : { gid : { 'mtime_files' : [...], ... } },
+	#	'age_buckets' : [30, 180, 365],
+	#	'tree' : { 'a/b' : { 'users' : { uid : [12345, 16384, 2] }, 'groups' : {...} } },
+	#	'tree_depth' : 2,
+	#	'bytes' : 12345,
+	#	'blocks' : 16384,
+	#	'files' : 2,
+	#	'errors' : 0,
+	#}
+
+	now = time.time()
+	age_buckets = settings.AGE_BUCKETS
+
+	def new_totals():
+		return {
+			'dirname' : quota_directory,
+			'users' : {},
+			'groups' : {},
+			'user_ages' : {},
+			'group_ages' : {},
+			'age_buckets' : age_buckets,
+			'tree' : {},
+			'tree_depth' : tree_depth,
+			'tree_parent' : None,
+			'tree_dirs' : [],
+			'bytes' : 0,
+			'blocks' : 0,
+			'files' : 0,
+			'errors' : 0,
+		}
+
+	def visit(data, path, st):
+		if tree_depth and path != quota_directory:
+			# The entries of a directory are visited together, so its
+			# rollup directories are only worked out once
+			parent = path.rpartition('/')[0]
+			if parent != data['tree_parent']:
+				data['tree_parent'] = parent
+				data['tree_dirs'] = tree_dirs(quota_directory, parent, tree_depth)
+			add_tree(data['tree'], data['tree_dirs'], 'users', st.st_uid, st.st_size, st.st_blocks * 512)
+			add_tree(data['tree'], data['tree_dirs'], 'groups', st.st_gid, st.st_size, st.st_blocks * 512)
+
+		if not stat.S_ISDIR(st.st_mode):
+			for key, i in [('user_ages', st.st_uid), ('group_ages', st.st_gid)]:
+				if i not in data[key]:
+					data[key][i] = new_age_totals(age_buckets)
+				add_age(data[key][i], st, now, age_buckets)
+
+		blocks = st.st_blocks * 512
+		users = data['users']
+		if st.st_uid not in users:
+			users[st.st_uid] = new_scan_totals()
+		u = users[st.st_uid]
+		u['bytes'] += st.st_size
+		u['blocks'] += blocks
+		u['files'] += 1
+		groups = data['groups']
+		if st.st_gid not in groups:
+			groups[st.st_gid] = new_scan_totals()
+		g = groups[st.st_gid]
+		g['bytes'] += st.st_size
+		g['blocks'] += blocks
+		g['files'] += 1
+		data['bytes'] += st.st_size
+		data['blocks'] += blocks
+		data['files'] += 1
+
+	def merge(data, other):
+		for key in ['users', 'groups']:
+			for i, t in other[key].items():
+				if i not in data[key]:
+					data[key][i] = new_scan_totals()
+				for field in t:
+					data[key][i][field] += t[field]
+		for key in ['user_ages', 'group_ages']:
+			for i, t in other[key].items():
+				if i not in data[key]:
+					data[key][i] = t
+				else:
+					merge_ages(data[key][i], t)
+		merge_tree(data['tree'], other['tree'])
+		for field in ['bytes', 'blocks', 'files', 'errors']:
+			data[field] += other[field]
+
+	if verbose:
+		print(f"Scanning {quota_directory} with {workers} worker(s)")
+
+	if index:
+		return scan_utilisation_indexed(quota_directory, verbose, workers, tree_depth)
+	data = walk_tree(quota_directory, new_totals, visit, merge, workers)
+	del data['tree_parent']
+	del data['tree_dirs']
+	return data
+
+def read_inventory_range(filename = "", start = 0, end = 0, layout = None, prefixes = [""], now = 0, age_buckets = settings.AGE_BUCKETS, tree_depth = 0):
+	""" Total one byte range of an inventory file, which starts and ends on
+	a line boundary, by owner and group as found in the file (ids or names,
+	as bytes). The file is memory-mapped and decoded INVENTORY_CHUNK bytes
+	at a time. Paths are totalled separately under each of prefixes, and
+	each line is only decoded once however many prefixes it falls under.
+	Returns one set of totals per prefix, in the same order. Runs in a
+	worker process when the file is split; see read_inventory_dirs(). """
+
+	def new_totals():
+		return {
+			'users' : {},
+			'groups' : {},
+			'user_ages' : {},
+			'group_ages' : {},
+			'tree' : {},
+			'bytes' : 0,
+			'blocks' : 0,
+			'files' : 0,
+			'errors' : 0,
+		}
+
+	columns = layout['columns']
+	separator = layout['separator']
+	if separator is not None:
+		separator = separator.encode()
+	marker = layout.get('path_marker')
+	if marker:
+		marker = marker.encode()
+	block_size = layout.get('block_size', 512)
+	i_uid = columns.index('uid')
+	i_gid = columns.index('gid')
+	i_size = columns.index('size')
+	i_blocks = columns.index('blocks') if 'blocks' in columns else None
+	i_type = columns.index('type') if 'type' in columns else None
+	with_ages = 'mtime' in columns and 'atime' in columns
+	if with_ages:
+		i_mtime = columns.index('mtime')
+		i_atime = columns.index('atime')
+
+	keys = [prefix.rstrip('/').encode() for prefix in prefixes]
+	all_totals = {}
+	for key in keys:
+		all_totals[key] = new_totals()
+
+	# The prefixes holding the entries of a directory, found from its
+	# ancestors, and their tree rollups; kept for as long as the lines
+	# stay in the same directory, which is how inventories are ordered
+	match_parent = None
+	matches = []
+
+	def find_matches(parent):
+		found = []
+		d = parent
+		while True:
+			if d in all_totals:
+				found.append((d, all_totals[d], tree_dirs(d, parent, tree_depth)))
+			if not d:
+				break
+			d = d.rpartition(b'/')[0]
+		return found
+
+	with open(filename, 'rb') as inventory_file:
+		with mmap.mmap(inventory_file.fileno(), 0, access = mmap.ACCESS_READ) as m:
+			pos = start
+			while pos < end:
+				chunk_end = end
+				if pos + INVENTORY_CHUNK < end:
+					chunk_end = m.rfind(b'\n', pos, pos + INVENTORY_CHUNK) + 1
+					if chunk_end <= pos:
+						chunk_end = m.find(b'\n', pos + INVENTORY_CHUNK, end) + 1 or end
+				for line in m[pos:chunk_end].split(b'\n'):
+					if not line:
+						continue
+					try:
+						if marker:
+							head, found, path = line.partition(marker)
+							if not found:
+								raise ValueError
+							cols = head.split(separator)
+						else:
+							cols = line.split(separator, len(columns))
+							path = cols[len(columns)]
+					except (ValueError, IndexError):
+						for totals in all_totals.values():
+							totals['errors'] += 1
+						continue
+
+					parent = path.rpartition(b'/')[0]
+					if parent != match_parent:
+						match_parent = parent
+						matches = find_matches(parent)
+					targets = matches
+					if path in all_totals:
+						# A prefix directory itself
+						targets = targets + [(path, all_totals[path], None)]
+					if not targets:
+						continue
+
+					try:
+						size = int(cols[i_size])
+						if i_blocks is None:
+							blocks = size
+						else:
+							blocks = int(cols[i_blocks]) * block_size
+						uid = cols[i_uid]
+						gid = cols[i_gid]
+						mtime = None
+						if with_ages and (i_type is None or cols[i_type] != b'd'):
+							mtime = float(cols[i_mtime])
+							atime = float(cols[i_atime])
+					except (ValueError, IndexError):
+						for prefix, totals, rollup in targets:
+							totals['errors'] += 1
+						continue
+
+					for prefix, totals, rollup in targets:
+						if mtime is not None:
+							for key, i in [('user_ages', uid), ('group_ages', gid)]:
+								if i not in totals[key]:
+									totals[key][i] = new_age_totals(age_buckets)
+								add_age_times(totals[key][i], mtime, atime, size, now, age_buckets)
+
+						if tree_depth and rollup is not None:
+							add_tree(totals['tree'], rollup, 'users', uid, size, blocks)
+							add_tree(totals['tree'], rollup, 'groups', gid, size, blocks)
+
+						users = totals['users']
+						if uid not in users:
+							users[uid] = new_scan_totals()
+						u = users[uid]
+						u['bytes'] += size
+						u['blocks'] += blocks
+						u['files'] += 1
+						groups = totals['groups']
+						if gid not in groups:
+							groups[gid] = new_scan_totals()
+						g = groups[gid]
+						g['bytes'] += size
+						g['blocks'] += blocks
+						g['files'] += 1
+						totals['bytes'] += size
+						totals['blocks'] += blocks
+						totals['files'] += 1
+				pos = chunk_end
+
+	return [all_totals[key] for key in keys]
+
+def read_inventory(filename = "", quota_directory = "/", layout_name = settings.INVENTORY_LAYOUT, verbose = False, workers = 1, tree_depth = 0):
+	""" Read a filesystem inventory, such as a GPFS policy list, an lfs find
+	--printf dump or a Robinhood export, instead of walking the tree. Only
+	paths under quota_directory are counted. The column layout is one of
+	settings.INVENTORY_LAYOUTS. Large files are split on line boundaries
+	into one range per worker process. Returns the same structure as
+	scan_utilisation(), with age histograms if the layout has file times,
+	or False if the file cannot be read. tree_depth is as for
+	scan_utilisation(). """
+
+	scans = read_inventory_dirs(filename, [quota_directory], layout_name, verbose, workers, tree_depth)
+	if scans is False:
+		return False
+	return scans[quota_directory]
+
+def read_inventory_dirs(filename = "", dir_names = [], layout_name = settings.INVENTORY_LAYOUT, verbose = False, workers = 1, tree_depth = 0):
+	""" As read_inventory(), for several directories from a single read of
+	the inventory file. Returns a dictionary of the read_inventory() result
+	for every directory in dir_names, or False if the file cannot be read. """
+
+	if layout_name not in settings.INVENTORY_LAYOUTS:
+		print("ERROR (read_inventory_dirs): unknown inventory layout %s" % layout_name)
+		return False
+	layout = settings.INVENTORY_LAYOUTS[layout_name]
+	now = time.time()
+	age_buckets = settings.AGE_BUCKETS
+
+	try:
+		size = os.path.getsize(filename)
+		ranges = []
+		start = 0
+		if size > 0:
+			with open(filename, 'rb') as inventory_file:
+				with mmap.mmap(inventory_file.fileno(), 0, access = mmap.ACCESS_READ) as m:
+					for i in range(1, max(workers, 1)):
+						end = m.find(b'\n', max(start, int(size * i / workers))) + 1
+						if end <= start:
+							break
+						ranges.append((start, end))
+						start = end
+		if start < size:
+			ranges.append((start, size))
+
+		if verbose:
+			print(f"Reading {filename} ({layout_name} layout) in {len(ranges)} part(s)")
+
+		parts = []
+		if len(ranges) > 1:
+			with concurrent.futures.ProcessPoolExecutor(max_workers = len(ranges)) as executor:
+				futures = [executor.submit(read_inventory_range, filename, s, e, layout, dir_names, now, age_buckets, tree_depth) for s, e in ranges]
+				for future in futures:
+					parts.append(future.result())
+		else:
+			for s, e in ranges:
+				parts.append(read_inventory_range(filename, s, e, layout, dir_names, now, age_buckets, tree_depth))
+	except Exception as err:
+		print("ERROR (read_inventory_dirs): %s" % err)
+		return False
+
+	# Owners are converted to ids once each, after the parts are combined
+	def owner_id(owner, lookup):
+		owner = owner.decode(errors = 'replace')
+		if owner.isdigit():
+			return int(owner)
+		i = lookup(owner)
+		if i is None:
+			return owner
+		return i
+
+	scans = {}
+	for n, dir_name in enumerate(dir_names):
+		data = {
+			'dirname' : dir_name,
+			'users' : {},
+			'groups' : {},
+			'user_ages' : {},
+			'group_ages' : {},
+			'age_buckets' : None,
+			'tree' : {},
+			'tree_depth' : tree_depth,
+			'bytes' : 0,
+			'blocks' : 0,
+			'files' : 0,
+			'errors' : 0,
+		}
+		if 'mtime' in layout['columns'] and 'atime' in layout['columns']:
+			data['age_buckets'] = age_buckets
+
+		for part in parts:
+			part = part[n]
+			for key, ages_key, lookup in [('users', 'user_ages', get_uid), ('groups', 'group_ages', get_gid)]:
+				for owner, t in part[key].items():
+					i = owner_id(owner, lookup)
+					if i not in data[key]:
+						data[key][i] = new_scan_totals()
+					for field in t:
+						data[key][i][field] += t[field]
+				for owner, t in part[ages_key].items():
+					i = owner_id(owner, lookup)
+					if i not in data[ages_key]:
+						data[ages_key][i] = new_age_totals(age_buckets)
+					merge_ages(data[ages_key][i], t)
+			for d, o in part['tree'].items():
+				d = d.decode(errors = 'surrogateescape')
+				for key, lookup in [('users', get_uid), ('groups', get_gid)]:
+					for owner, t in o[key].items():
+						add_tree(data['tree'], [d], key, owner_id(owner, lookup), t[0], t[1], t[2])
+			for field in ['bytes', 'blocks', 'files', 'errors']:
+				data[field] += part[field]
+		scans[dir_name] = data
+
+	return scans
+
+def get_user_utilisation_scan(scan = None, user_name = "myuser", allocated = False, top_k = settings.TREE_TOP, uid = None):
+	""" Report the utilisation of one user from a scan_utilisation() result,
+	in the same form as get_user_utilisation(). Sizes are apparent file
+	sizes, or allocated blocks (as ls -s) if allocated is set. If the scan
+	has a tree rollup, the user's top_k directories are added as 'tree'.
+	uid may be given for owners which no longer have a username. """
+
+	data = {
+		'username'	: user_name,
+		'dirname'	: scan['dirname'],
+		'quota'		: 0,
+		'limit'		: 0,
+		'files'		: 0
+	}
+
+	if uid is None:
+		uid = get_uid(user_name)
+	if uid in scan['users']:
+		totals = scan['users'][uid]
+		if allocated:
+			data['quota'] = int(totals['blocks'] / 1024)
+		else:
+			data['quota'] = int(totals['bytes'] / 1024)
+		data['files'] = totals['files']
+	if scan.get('age_buckets'):
+		data['ages'] = age_report(scan['user_ages'].get(uid, new_age_totals(scan['age_buckets'])), scan['age_buckets'])
+	if scan.get('tree_depth'):
+		data['tree'] = tree_report(scan, 'users', uid, allocated, top_k)
+	return data
+
+def get_group_utilisation_scan(scan = None, group_name = "mygroup", allocated = False, top_k = settings.TREE_TOP, gid = None):
+	""" Report the utilisation of one group from a scan_utilisation() result,
+	in the same form as get_group_utilisation(). Sizes are apparent file
+	sizes, or allocated blocks (as ls -s) if allocated is set. If the scan
+	has a tree rollup, the group's top_k directories are added as 'tree'.
+	gid may be given for owners which no longer have a group name. """
+
+	data = {
+		'group'		: group_name,
+		'dirname'	: scan['dirname'],
+		'quota'		: 0,
+		'limit'		: 0,
+		'files'		: 0
+	}
+
+	if gid is None:
+		gid = get_gid(group_name)
+	if gid in scan['groups']:
+		totals = scan['groups'][gid]
+		if allocated:
+			data['quota'] = int(totals['blocks'] / 1024)
+		else:
+			data['quota'] = int(totals['bytes'] / 1024)
+		data['files'] = totals['files']
+	if scan.get('age_buckets'):
+		data['ages'] = age_report(scan['group_ages'].get(gid, new_age_totals(scan['age_buckets'])), scan['age_buckets'])
+	if scan.get('tree_depth'):
+		data['tree'] = tree_report(scan, 'groups', gid, allocated, top_k)
+	return data
+
+def audit_group_tree(quota_directory = "/mydir", group_name = "mygroup", username_list = [], allocated = False, verbose = False, workers = 1, index = False, old_age = 180, top_n = settings.TOP_FILES, manifest = None, inventory = None, layout_name = settings.INVENTORY_LAYOUT, scan = None):
+	""" Audit a group directory tree in a single walk, gathering the space
+	used by the group, by each member of the group, by files set to another
+	group, and by files owned by users who are not members of the group.
+	Sizes are apparent file sizes, or allocated blocks (as ls -s) if
+	allocated is set, and are returned in kilobytes. If index is set the
+	figures come from an indexed scan_utilisation() instead, which only
+	walks changed directories but cannot list the alien files. File age
+	histograms, and the data not modified in 'old_age' days, are gathered
+	for the whole tree and for each member, except with index.
+
+	If inventory is given, the figures come from that inventory file
+	instead (see read_inventory()), again without the alien file lists;
+	file ages are included if the inventory layout has file times. A
+	scan already read for quota_directory, e.g. by read_inventory_dirs(),
+	may be given instead of the inventory file.
+
+	Alien files are counted, keeping only the 'top_n' largest for the
+	alien group and for each alien user. If 'manifest' is given, every
+	alien file is also written to '<manifest>-group.gz' and/or
+	'<manifest>-users.gz' during the walk. """
+
+	# Returns the following structure
+	#data = {
+	#	'dirname' : '/mydir',
+	#	'group' : 'mygroup',
+	#	'group_utilisation' : { 'group', 'dirname', 'quota', 'limit', 'files' : 123 },
+	#	'user_utilisation' : [ { 'user' : 'bob', 'data' : { 'username', 'dirname', 'quota', 'limit', 'files' : 12 } } ],
+	#	'alien_group_utilisation' : { 'group', 'dirname', 'quota', 'limit', 'files' : 2, 'largest' : [ { 'file', 'kbytes' } ], 'manifest' : None },
+	#	'alien_user_utilisation' : { 'files' : 2, 'users' : { uid : { 'files', 'largest', 'username', 'uid', 'quota' } }, 'quota', 'manifest' : None },
+	#	'ages' : { 'mtime' : [ { 'bucket' : '<30d', 'files' : 12, 'kbytes' : 345 }, ... ], 'atime' : [...] },
+	#	'old_data' : { 'days' : 180, 'files' : 12, 'kbytes' : 345 },
+	#	'errors' : 0,
+	#}
+
+	now = time.time()
+	age_buckets = settings.AGE_BUCKETS
+	old_time = now - (old_age * 86400)
+
+	gid = get_gid(group_name)
+
+	member_uids = {}
+	for user_name in username_list:
+		uid = get_uid(user_name)
+		if uid is not None:
+			member_uids[uid] = user_name
+
+	manifests = { 'group' : None, 'users' : None }
+	if manifest and not (index or inventory or scan):
+		for key in manifests:
+			manifests[key] = open_manifest(f"{manifest}-{key}.gz")
+
+	def new_totals():
+		return {
+			'group' : { 'bytes' : 0, 'files' : 0 },
+			'members' : {},
+			'alien_group' : new_file_list(top_n),
+			'alien_users' : {},
+			'ages' : new_age_totals(age_buckets),
+			'old' : { 'bytes' : 0, 'files' : 0 },
+			'paths' : { 'group' : [], 'users' : [] },
+			'errors' : 0,
+		}
+
+	def add_path(data, key, path):
+		# Written in batches, so workers rarely wait on the manifest lock
+		if manifests[key]:
+			data['paths'][key].append(path)
+			if len(data['paths'][key]) >= 1024:
+				write_manifest(manifests[key], data['paths'][key])
+
+	def visit(data, path, st):
+		if allocated:
+			size = st.st_blocks * 512
+		else:
+			size = st.st_size
+
+		is_file = not stat.S_ISDIR(st.st_mode)
+		if is_file:
+			add_age(data['ages'], st, now, age_buckets)
+			if st.st_mtime < old_time:
+				data['old']['bytes'] += size
+				data['old']['files'] += 1
+
+		if st.st_gid == gid:
+			data['group']['bytes'] += size
+			data['group']['files'] += 1
+		else:
+			add_file(data['alien_group'], size, path)
+			add_path(data, 'group', path)
+
+		if add_orphaned_file(data['alien_users'], member_uids, st.st_uid, size, path, top_n):
+			add_path(data, 'users', path)
+		else:
+			if st.st_uid not in data['members']:
+				data['members'][st.st_uid] = { 'bytes' : 0, 'files' : 0, 'ages' : new_age_totals(age_buckets) }
+			data['members'][st.st_uid]['bytes'] += size
+			data['members'][st.st_uid]['files'] += 1
+			if is_file:
+				add_age(data['members'][st.st_uid]['ages'], st, now, age_buckets)
+
+	def merge(data, other):
+		for key in ['group', 'old']:
+			for field in data[key]:
+				data[key][field] += other[key][field]
+		merge_file_lists(data['alien_group'], other['alien_group'])
+		for uid, t in other['members'].items():
+			if uid not in data['members']:
+				data['members'][uid] = t
+			else:
+				data['members'][uid]['bytes'] += t['bytes']
+				data['members'][uid]['files'] += t['files']
+				merge_ages(data['members'][uid]['ages'], t['ages'])
+		merge_orphaned_files(data['alien_users'], other['alien_users'])
+		for key in manifests:
+			write_manifest(manifests[key], other['paths'][key])
+		merge_ages(data['ages'], other['ages'])
+		data['errors'] += other['errors']
+
+	def from_scan(scan):
+		# The same totals, from the by uid and by gid totals of a scan
+		if allocated:
+			size = 'blocks'
+		else:
+			size = 'bytes'
+		data = new_totals()
+		for i, t in scan['groups'].items():
+			if i == gid:
+				data['group']['bytes'] += t[size]
+				data['group']['files'] += t['files']
+			else:
+				data['alien_group']['bytes'] += t[size]
+				data['alien_group']['count'] += t['files']
+		for i, t in scan['users'].items():
+			if i in member_uids:
+				data['members'][i] = { 'bytes' : t[size], 'files' : t['files'] }
+			else:
+				data['alien_users'][i] = new_file_list(0)
+				data['alien_users'][i]['bytes'] = t[size]
+				data['alien_users'][i]['count'] = t['files']
+		data['errors'] = scan['errors']
+		data['old'] = None
+		if scan.get('age_buckets'):
+			for i, t in scan['user_ages'].items():
+				merge_ages(data['ages'], t)
+				if i in data['members']:
+					data['members'][i]['ages'] = t
+		else:
+			data['ages'] = None
+		return data
+
+	if scan:
+		totals = from_scan(scan)
+	elif inventory:
+		scan = read_inventory(inventory, quota_directory, layout_name, verbose, workers)
+		if scan is False:
+			return False
+		totals = from_scan(scan)
+	elif index:
+		totals = from_scan(scan_utilisation(quota_directory, verbose, workers, index = True))
+	else:
+		if verbose:
+			print(f"Scanning {quota_directory} with {workers} worker(s)")
+		totals = walk_tree(quota_directory, new_totals, visit, merge, workers)
+		for key in manifests:
+			write_manifest(manifests[key], totals['paths'][key])
+			manifests[key] = close_manifest(manifests[key])
+
+	data = {
+		'dirname' : quota_directory,
+		'group' : group_name,
+		'group_utilisation' : {
+			'group'		: group_name,
+			'dirname'	: quota_directory,
+			'quota'		: int(totals['group']['bytes'] / 1024),
+			'limit'		: 0,
+			'files'		: totals['group']['files']
+		},
+		'user_utilisation' : [],
+		'alien_group_utilisation' : {
+			'group'		: group_name,
+			'dirname'	: quota_directory,
+			'quota'		: int(totals['alien_group']['bytes'] / 1024),
+			'limit'		: 0,
+			'files'		: totals['alien_group']['count'],
+			'largest'	: largest_files(totals['alien_group']),
+			'manifest'	: manifests['group']
+		},
+		'alien_user_utilisation' : orphaned_files_report(totals['alien_users']),
+		'ages' : None,
+		'old_data' : None,
+		'errors' : totals['errors'],
+	}
+
+	if totals['ages']:
+		data['ages'] = age_report(totals['ages'], age_buckets)
+	if totals['old']:
+		data['old_data'] = { 'days' : old_age, 'files' : totals['old']['files'], 'kbytes' : int(totals['old']['bytes'] / 1024) }
+
+	for user_name in username_list:
+		user_data = {
+			'username'	: user_name,
+			'dirname'	: quota_directory,
+			'quota'		: 0,
+			'limit'		: 0,
+			'files'		: 0
+		}
+		member_ages = new_age_totals(age_buckets)
+		for uid, name in member_uids.items():
+			if name == user_name and uid in totals['members']:
+				user_data['quota'] = int(totals['members'][uid]['bytes'] / 1024)
+				user_data['files'] = totals['members'][uid]['files']
+				if 'ages' in totals['members'][uid]:
+					member_ages = totals['members'][uid]['ages']
+		if totals['ages']:
+			user_data['ages'] = age_report(member_ages, age_buckets)
+		data['user_utilisation'].append({ 'user' : user_name, 'data' : user_data })
+
+	data['alien_user_utilisation']['manifest'] = manifests['users']
+
+	return data
+
 def decode_ls_orphaned_files(ls_output = "", username_list = []):
 	""" Decode a block of -aslLR output, recording files which *do not* belong to a list of usernames """
 
@@ -270,11 +1620,11 @@ def decode_ls_output_byuser(ls_output = "", user_name = "myname", invert = False
 	
 	# Returns the following structure
 	#ls_data = {
-	#	'files' : ['/a/list/of/filenames'],
+	#	'files' : 12,
 	#	'bytes' : 12345,
 	#}
 	ls_data = {
-		'files' : [],
+		'files' : 0,
 		'bytes' : 0,
 		'kbytes' : 0,
 	}
@@ -321,13 +1671,13 @@ def decode_ls_output_byuser(ls_output = "", user_name = "myname", invert = False
 							# Are we looking for non-matching owners?
 							if invert:
 								if unix_owner != user_name:
-									ls_data['files'].append(full_file_path)
+									ls_data['files'] += 1
 									ls_data['bytes'] = ls_data['bytes'] + file_size
 									
 							# ... or matching owners?
 							else:
 								if unix_owner == user_name:
-									ls_data['files'].append(full_file_path)
+									ls_data['files'] += 1
 									ls_data['bytes'] = ls_data['bytes'] + file_size
 		except Exception as err:
 			print("ERROR (decode_ls_output_byuser): %s" % err)					
@@ -358,11 +1708,11 @@ def decode_ls_output_bygroup(ls_output = "", group_name = "mygroup", invert = Fa
 	
 	# Returns the following structure
 	#ls_data = {
-	#	'files' : ['/a/list/of/filenames'],
+	#	'files' : 12,
 	#	'bytes' : 12345,
 	#}
 	ls_data = {
-		'files' : [],
+		'files' : 0,
 		'bytes' : 0,
 		'kbytes' : 0,
 	}
@@ -411,13 +1761,13 @@ def decode_ls_output_bygroup(ls_output = "", group_name = "mygroup", invert = Fa
 							# Are we looking for non-matching groups?
 							if invert:
 								if unix_group != group_name:
-									ls_data['files'].append(full_file_path)
+									ls_data['files'] += 1
 									ls_data['bytes'] = ls_data['bytes'] + file_size
 									
 							# ... or matching groups?
 							else:
 								if unix_group == group_name:
-									ls_data['files'].append(full_file_path)
+									ls_data['files'] += 1
 									ls_data['bytes'] = ls_data['bytes'] + file_size
 		except Exception as err:
 			print("ERROR (decode_ls_output_bygroup): %s" % err)
@@ -438,7 +1788,7 @@ def get_group_utilisation_ls(find_type = "ls", group_name = "mygroup", quota_dir
 		'dirname'	: quota_directory,
 		'quota'		: 0,
 		'limit'		: 0,
-		'files'		: []
+		'files'		: 0
 	}
 	
 	job_cmd = f"ls -alskLR {quota_directory} 2>/dev/null"
@@ -455,7 +1805,7 @@ def get_group_utilisation_ls(find_type = "ls", group_name = "mygroup", quota_dir
 			for ls_output in output:
 				ls_data = decode_ls_output_bygroup(ls_output, group_name, invert)
 				data['quota'] = data['quota'] + ls_data['kbytes']
-				data['files'] = data['files'] + ls_data['files']
+				data['files'] += ls_data['files']
 				
 		return data
 
@@ -487,7 +1837,7 @@ def get_group_utilisation(find_type = "normal", group_name = "mygroup", quota_di
 		'dirname'	: quota_directory,
 		'quota'		: 0,
 		'limit'		: 0,
-		'files'		: []
+		'files'		: 0
 	}
 	
 	try:
@@ -500,7 +1850,6 @@ def get_group_utilisation(find_type = "normal", group_name = "mygroup", quota_di
 			output = process.stdout.read().rstrip().split(b'\n')
 			if len(output) > 1:
 				found_files_b = output
-				found_files = []
 			
 				for f in found_files_b:
 					try:
@@ -511,7 +1860,7 @@ def get_group_utilisation(find_type = "normal", group_name = "mygroup", quota_di
 						if len(f_size) > 0:
 							f_size = int(f_size)
 							data['quota'] = data['quota'] + f_size
-						found_files.append(f.decode())
+						data['files'] += 1
 					except Exception as err:
 						# In case any files have names that we cannot decode
 						#print(f"Error, {err}")
@@ -542,7 +1891,7 @@ def get_user_utilisation_ls(find_type = "normal", user_name = "myuser", quota_di
 		'dirname'	: quota_directory,
 		'quota'		: 0,
 		'limit'		: 0,
-		'files'		: []
+		'files'		: 0
 	}
 	
 	try:
@@ -557,7 +1906,7 @@ def get_user_utilisation_ls(find_type = "normal", user_name = "myuser", quota_di
 				ls_data = decode_ls_output_byuser(ls_output, user_name)
 				if ls_data:
 					data['quota'] = data['quota'] + ls_data['kbytes']
-					data['files'] = data['files'] + ls_data['files']
+					data['files'] += ls_data['files']
 				
 		return data
 
@@ -618,19 +1967,64 @@ def get_user_utilisation(find_type = "normal", user_name = "myuser", quota_direc
 		print("ERROR (get_user_utilisation): %s" % err)
 		return False
 		
-def get_user_orphaned_files_ls(find_type = "normal", username_list = None, quota_directory = "/mydir", cmd_only = False, verbose = False):
-	""" Get a list of files which are owned by users other than those in the provided username_list. """
+def add_orphaned_file(orphans = None, member_uids = None, uid = 0, size = 0, path = "", top_n = settings.TOP_FILES):
+	""" Count one file against its owner in orphans, a dictionary of file
+	lists by uid, unless the owner is in member_uids (any set or dictionary
+	of the member uids, so the check does not grow with the group).
+	Returns True if the file is orphaned. """
+
+	if uid in member_uids:
+		return False
+	if uid not in orphans:
+		orphans[uid] = new_file_list(top_n)
+	add_file(orphans[uid], size, path)
+	return True
+
+def merge_orphaned_files(orphans = None, other = None):
+	""" Merge the orphaned files found by one worker into another's """
+
+	for uid, t in other.items():
+		if uid not in orphans:
+			orphans[uid] = t
+		else:
+			merge_file_lists(orphans[uid], t)
+
+def orphaned_files_report(users = None):
+	""" Turn the file lists of the owners of orphaned files, by uid or name,
+	into the orphaned files report; sizes are in kilobytes. Uids are
+	resolved to usernames ("" for uids with no user). """
+
+	data = {
+		'files' : 0,	# Number of files that are found
+		'users' : {},	# A dictionary of users whose files are found, including space utilisation for each
+		'quota' : 0		# Sum of the entire space utilisation of the found files
+	}
+	for uid, t in users.items():
+		if isinstance(uid, int):
+			username = get_username(uid)
+		else:
+			username = uid
+		data['users'][uid] = {
+			'files' : t['count'],
+			'largest' : largest_files(t),
+			'username' : username,
+			'uid' : uid,
+			'quota' : int(t['bytes'] / 1024)
+		}
+		data['files'] += t['count']
+		data['quota'] += t['bytes']
+	data['quota'] = int(data['quota'] / 1024)
+	return data
+
+def get_user_orphaned_files_ls(find_type = "normal", username_list = None, quota_directory = "/mydir", cmd_only = False, verbose = False, top_n = settings.TOP_FILES):
+	""" Get the files which are owned by users other than those in the provided username_list. """
 	
 	job_cmd = f"ls -alskLR {quota_directory} 2>/dev/null"
 	
 	if cmd_only:
 		return job_cmd
 	
-	data = {
-		'files' : [],	# A list of files that are found
-		'users' : {},	# A dictionary of users whose files are found, including space utilisation for each
-		'quota' : 0		# Sum of the entire space utilisation of the found files
-	}
+	users = {}
 	
 	try:
 		if verbose:
@@ -643,32 +2037,26 @@ def get_user_orphaned_files_ls(find_type = "normal", username_list = None, quota
 			for ls_output in output:
 				found_files = decode_ls_orphaned_files(ls_output, username_list)
 				for f in found_files:
-						data['files'].append(f)
-						
 						uid = f['username']
-						gid = f['groupname']
-						if uid not in data['users']:
-							data['users'][uid] = {
-								'files' : [],
-								'username' : "",
-								'uid' : uid,
-								'quota' : 0
-							}
-							
-						data['users'][uid]['files'].append(f)
-						data['users'][uid]['quota'] = data['users'][uid]['quota'] + f['kbytes']
+						if uid not in users:
+							users[uid] = new_file_list(top_n)
 						
-						# INcrease the count of space used
-						data['quota'] = data['quota'] + f['kbytes']
-			return data
+						# ls -s sizes are in kbytes
+						add_file(users[uid], f['kbytes'] * 1024, f['file'])
+			return orphaned_files_report(users)
 
 	except Exception as err:
 		print("ERROR (get_user_orphaned_files_ls): %s" % err)
 		return False
 			
 		
-def get_user_orphaned_files(find_type = "normal", username_list = None, quota_directory = "/mydir", cmd_only = False, verbose = False):
-	""" Get a list of files which are owned by users other than those in the provided username_list. """
+def get_user_orphaned_files(find_type = "normal", username_list = None, quota_directory = "/mydir", cmd_only = False, verbose = False, workers = 1, top_n = settings.TOP_FILES):
+	""" Get the files which are owned by users other than those in the provided username_list.
+	The find command is only built for cmd_only, as a hint; the files are
+	found in a single walk of the tree, checking the owner from the lstat
+	the walk already made against a set of the member uids, so there is no
+	find clause per user or second stat of every file. Results are by uid,
+	with usernames filled in. """
 	
 	if find_type == "generic":
 		if len(username_list) == 1:
@@ -698,70 +2086,27 @@ def get_user_orphaned_files(find_type = "normal", username_list = None, quota_di
 	
 	if cmd_only:
 		return job_cmd
-	
-	data = {
-		'files' : [],	# A list of files that are found
-		'users' : {},	# A dictionary of users whose files are found, including space utilisation for each
-		'quota' : 0		# Sum of the entire space utilisation of the found files
-	}
-	
-	try:
-		if verbose:
-			print(f"Running {job_cmd}")
-		process = subprocess.Popen(job_cmd, shell=True,
-					stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-					stderr=subprocess.STDOUT)
-		if process:
-			output = process.stdout.read().rstrip().split(b'\n')
-			if len(output) > 1:
-				found_files_b = output
-				found_files = []
-				for f in found_files_b:
-					try:
-						found_files.append(f.decode())
-					except Exception as e:
-						# In case any files have names that we cannot decode
-						#print(f"Error, {e}")
-						pass
-				# Sum the total capacity used by each file
-				for f in found_files:
-					try:
-						file_data = os.stat(f)
-						# Record the filename
-						data['files'].append(f)
-						
-						uid = file_data.st_uid
-						gid = file_data.st_gid
-						if uid not in data['users']:
-							data['users'][uid] = {
-								'files' : [],
-								'username' : "",
-								'uid' : uid,
-								'quota' : 0
-							}
-							
-						data['users'][uid]['files'].append(f)
-						data['users'][uid]['quota'] = data['users'][uid]['quota'] + int(file_data.st_size / 1024)
-						
-						# INcrease the count of space used
-						data['quota'] = data['quota'] + file_data.st_size
-					except Exception as err:
-						pass
-					
-				# st_size is in bytes, so store as kbytes
-				if data['quota'] > 1024:
-					data['quota'] = int(data['quota'] / 1024)
-				else:
-					data['quota'] = 0
-					
-				# Map uid to username for all found
-				# uids
-				for uid in data['users']:
-					pass
-							
-		return(data)
 
-	except Exception as err:
-		return False
-	
-	
+	member_uids = set()
+	for user_name in username_list:
+		uid = get_uid(user_name)
+		if uid is not None:
+			member_uids.add(uid)
+
+	def new_totals():
+		return { 'users' : {}, 'errors' : 0 }
+
+	def visit(data, path, st):
+		add_orphaned_file(data['users'], member_uids, st.st_uid, st.st_size, path, top_n)
+
+	def merge(data, other):
+		merge_orphaned_files(data['users'], other['users'])
+		data['errors'] += other['errors']
+
+	if verbose:
+		print(f"Scanning {quota_directory} with {workers} worker(s)")
+	totals = walk_tree(quota_directory, new_totals, visit, merge, workers)
+
+	data = orphaned_files_report(totals['users'])
+	data['errors'] = totals['errors']
+	return data
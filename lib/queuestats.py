@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""
+Simple Slurm Tools
+Copyright (C) 2024 John Snowdon
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#####################################################################
+#
+# Running queue summary figures, which jobs can be added to and
+# removed from as the queue changes.
+#
+# Produces the same stats as the sjobs summary, but without walking
+# every job again on each refresh. Job times are held as the epoch
+# the job started (running) or was submitted (pending), so they
+# carry on growing between refreshes without the job being touched.
+#
+#####################################################################
+
+import heapq
+
+# Summary figure names and the job fields they are taken from
+METRIC_FIELDS = {
+	'cores' : 'AllocCPUS',
+	'ramjob' : 'TotalMemory',
+	'ramcore' : 'MemoryPerCore',
+}
+
+# A heap is rebuilt from the current values once it holds more than
+# twice as many entries as there are distinct values, plus this many
+HEAP_SLACK = 64
+
+def job_epoch(job = None, now = 0):
+	""" The epoch from which the time figure of a job is counted; the start
+	time of a running job, or the submit time of a pending job """
+
+	if job['StateCode'] == 'R':
+		return now - (job['ElapsedTime'] * 60)
+	return now - (job['SubmitMinutes'] * 60)
+
+class QueueStats():
+	""" Queue summary figures for running and pending jobs, kept up to date
+	as jobs are added and removed """
+
+	def __init__(self, jobtypes = ['R', 'PD']):
+
+		self.jobtypes = jobtypes
+		self.totals = {}
+		for jobtype in jobtypes:
+			self.totals[jobtype] = {
+				'jobs' : 0,
+				'users' : {},
+				'epoch_sum' : 0,
+				'sums' : {},
+				'counts' : {},
+				'heaps' : {},
+			}
+			# 'age' is the negated epoch, so its maximum is the oldest job
+			for metric in list(METRIC_FIELDS.keys()) + ['age']:
+				self.totals[jobtype]['sums'][metric] = 0
+				self.totals[jobtype]['counts'][metric] = {}
+				self.totals[jobtype]['heaps'][metric] = []
+
+	def update_value(self, t = None, metric = "", value = 0, delta = 1):
+		""" Add (delta 1) or remove (delta -1) a single value of a metric """
+
+		counts = t['counts'][metric]
+		t['sums'][metric] += value * delta
+		if delta > 0 and value not in counts:
+			heapq.heappush(t['heaps'][metric], -value)
+		counts[value] = counts.get(value, 0) + delta
+		if counts[value] <= 0:
+			del counts[value]
+
+		# Removed values are only dropped from the heap when they reach the
+		# top, so rebuild it before the stale entries can pile up
+		if len(t['heaps'][metric]) > (2 * len(counts)) + HEAP_SLACK:
+			heap = [-v for v in counts]
+			heapq.heapify(heap)
+			t['heaps'][metric] = heap
+
+	def max_value(self, t = None, metric = ""):
+		""" Largest current value of a metric. Values which have since been
+		removed are discarded from the top of the heap as they are found. """
+
+		heap = t['heaps'][metric]
+		counts = t['counts'][metric]
+		while heap and -heap[0] not in counts:
+			heapq.heappop(heap)
+		if heap:
+			return -heap[0]
+		return 0
+
+	def update(self, job = None, epoch = 0, delta = 1):
+		""" Add or remove the contribution of one job """
+
+		if job['StateCode'] not in self.totals:
+			return
+		t = self.totals[job['StateCode']]
+
+		t['jobs'] += delta
+		t['users'][job['User']] = t['users'].get(job['User'], 0) + delta
+		if t['users'][job['User']] <= 0:
+			del t['users'][job['User']]
+
+		for metric, field in METRIC_FIELDS.items():
+			self.update_value(t, metric, job[field], delta)
+		self.update_value(t, 'age', -epoch, delta)
+
+	def add(self, job = None, epoch = 0):
+		""" Add a job which has appeared, or changed, in the queue """
+		self.update(job, epoch, 1)
+
+	def remove(self, job = None, epoch = 0):
+		""" Remove a job which has left, or changed, in the queue """
+		self.update(job, epoch, -1)
+
+	def summary(self, now = 0):
+		""" Return the current figures, in the same form as the sjobs summary """
+
+		stats = {}
+		for jobtype in self.jobtypes:
+			t = self.totals[jobtype]
+			stats[jobtype] = {}
+			stats[jobtype]['jobs'] = t['jobs']
+			stats[jobtype]['users'] = len(t['users'])
+			for metric in METRIC_FIELDS:
+				stats[jobtype][metric] = {
+					'sum' : t['sums'][metric],
+					'max' : self.max_value(t, metric),
+					'mean' : 0
+				}
+
+			# Minutes since start/submit, from the sum and minimum of the epochs
+			stats[jobtype]['time'] = { 'sum' : 0, 'max' : 0, 'mean' : 0 }
+			if t['jobs'] > 0:
+				stats[jobtype]['time']['sum'] = ((t['jobs'] * now) + t['sums']['age']) / 60
+				stats[jobtype]['time']['max'] = (now + self.max_value(t, 'age')) / 60
+
+			if t['jobs'] > 0:
+				for metric in list(METRIC_FIELDS.keys()) + ['time']:
+					stats[jobtype][metric]['mean'] = stats[jobtype][metric]['sum'] / t['jobs']
+
+		return stats
@@ -35,6 +35,65 @@ HTML_PATH  = "./html/"
 # Where persistent cache resides
 CACHE_PATH = "./report_cache/"
 
+# Number of worker processes used when generating stats for a run of days
+STATS_WORKERS = 4
+
+# Number of threads used by diskrep and grouprep to walk a directory tree.
+# More than one mostly helps on network/parallel filesystems (Lustre, GPFS)
+# where each directory listing and stat waits on a metadata server
+SCAN_WORKERS = 1
+
+# Number of filesystems diskrep reports on at once, when given several;
+# each is still walked with at most SCAN_WORKERS (or -workers) threads
+FILESYSTEM_WORKERS = 4
+
+# Number of group folders grouprep audits at once with -parent or -map;
+# each is still walked with at most SCAN_WORKERS (or -workers) threads
+GROUP_WORKERS = 4
+
+# Boundaries, in days, of the file age buckets reported by diskrep and
+# grouprep; [30, 180, 365] gives <30d, 30d-180d, 180d-1y and >1y
+AGE_BUCKETS = [30, 180, 365]
+
+# Record the disk use found by every diskrep run in CACHE_PATH, for the
+# -trend report, and the number of days of that history -trend looks at
+USAGE_HISTORY = True
+TREND_DAYS = 30
+
+# Number of the largest directories listed for each user or group by
+# diskrep -tree, by space used and by number of files
+TREE_TOP = 10
+
+# Number of the largest matching files kept, for each user or group, by
+# the grouprep audit; the rest are only counted. 0 keeps none
+TOP_FILES = 10
+
+# Column layouts of the filesystem inventory (metadata dump) files read by
+# diskrep and grouprep -inventory. Lines are split on 'separator' (None is
+# any whitespace) into 'columns', and the path is the rest of the line, or
+# whatever follows 'path_marker'. Columns named None are skipped. Owners may
+# be ids or names; 'size' is in bytes, 'blocks' in units of 'block_size'
+# (size is used if there is no blocks column), times are epoch seconds and
+# a 'type' of d marks a directory. File ages need both mtime and atime.
+INVENTORY_LAYOUTS = {
+	# find DIR -printf '%y|%U|%G|%s|%b|%T@|%A@|%p\n' (or lfs find --printf)
+	'find' : { 'separator' : '|', 'columns' : ['type', 'uid', 'gid', 'size', 'blocks', 'mtime', 'atime'], 'block_size' : 512 },
+	# GPFS policy LIST with SHOW(VARCHAR(USER_ID) || ' ' || VARCHAR(GROUP_ID)
+	# || ' ' || VARCHAR(FILE_SIZE) || ' ' || VARCHAR(KB_ALLOCATED))
+	'gpfs' : { 'separator' : None, 'columns' : [None, None, None, 'uid', 'gid', 'size', 'blocks'], 'block_size' : 1024, 'path_marker' : ' -- ' },
+	# Robinhood rbh-find -printf '%u|%g|%s|%p\n', by owner and group name
+	'robinhood' : { 'separator' : '|', 'columns' : ['uid', 'gid', 'size'], 'block_size' : 512 },
+}
+INVENTORY_LAYOUT = 'find'
+
+# Number of lfs quota calls run at once when reading every quota on Lustre
+QUOTA_WORKERS = 8
+
+# Address, port and refresh interval (seconds) of the sexporter metrics server
+EXPORTER_BIND = "0.0.0.0"
+EXPORTER_PORT = 9341
+EXPORTER_INTERVAL = 60
+
 # Partition names
 PARTITIONS = ['defq', 'short', 'long', 'interactive', 'bigmem', 'dell-gpu', 'power']
 
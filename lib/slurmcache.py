@@ -24,10 +24,12 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 #####################################################################
 
+import base64
 import datetime
 import json
 import hashlib
 import os
+from array import array
 import lib.settings as settings
 
 CODE_FILES = ["lib/slurmjob.py"]
@@ -38,6 +40,25 @@ class slurmCache():
 		self.master_key = None
 		self.debug = settings.DEBUG
 
+	def encode_value(self, value = None):
+		""" json default hook; stores a compact array, such as the node usage
+		of a summary, as its type code and base64 encoded bytes rather than
+		as a list of numbers """
+
+		if isinstance(value, array):
+			return { '__array__' : value.typecode, 'data' : base64.b64encode(value.tobytes()).decode() }
+		raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+	def decode_value(self, value = None):
+		""" json object hook; turns an array stored by encode_value() back
+		into an array """
+
+		if '__array__' in value:
+			data = array(value['__array__'])
+			data.frombytes(base64.b64decode(value['data']))
+			return data
+		return value
+
 	def hashcode(self):
 		""" Hash all of the source files which will be used to
 		generate a report. If they change, then we know that the 
@@ -70,19 +91,23 @@ class slurmCache():
 		return k
 		
 		
+	def filename(self, year = 0, month = 0, day = 0, hours = 0, minutes = 0, key = ""):
+		""" The file a persistent data object is stored in """
+		
+		k = self.hashkey(year, month, day, hours, minutes, key)
+		return settings.CACHE_PATH + "/" + k + ".json"
+		
 	def store(self, year = 0, month = 0, day = 0, hours = 0, minutes = 0, key = "", data = None):
 		""" Store a persistent data object on disk """
 		
 		if data:
 				
-			k = self.hashkey(year, month, day, hours, minutes, key)
-			
-			cache_filename = settings.CACHE_PATH + "/" + k + ".json"
+			cache_filename = self.filename(year, month, day, hours, minutes, key)
 			
 			if os.path.exists(cache_filename):
 				os.remove(cache_filename)
 				
-			json_data = json.dumps(data)
+			json_data = json.dumps(data, default = self.encode_value)
 			
 			cache_file = open(cache_filename, "w")
 			cache_file.write(json_data)
@@ -94,16 +119,14 @@ class slurmCache():
 	def load(self, year = 0, month = 0, day = 0, hours = 0, minutes = 0, key = ""):
 		""" Load a persistent cache object from disk """
 
-		k = self.hashkey(year, month, day, hours, minutes, key)
-			
-		cache_filename = settings.CACHE_PATH + "/" + k + ".json"
+		cache_filename = self.filename(year, month, day, hours, minutes, key)
 		
 		if os.path.exists(cache_filename):
 			if self.debug:
 				print("-- Cache loading %s" % cache_filename)
 			cache_file = open(cache_filename, "r")
 			cache_data = cache_file.read()
-			data = json.loads(cache_data)
+			data = json.loads(cache_data, object_hook = self.decode_value)
 			cache_file.close()
 			return data
 		else:
@@ -121,7 +144,7 @@ class slurmCache():
 			if os.path.exists(cache_filename):
 				os.remove(cache_filename)
 				
-			json_data = json.dumps(data)
+			json_data = json.dumps(data, default = self.encode_value)
 			
 			cache_file = open(cache_filename, "w")
 			cache_file.write(json_data)
@@ -142,7 +165,7 @@ class slurmCache():
 				print("-- Cache loading %s" % cache_filename)
 			cache_file = open(cache_filename, "r")
 			cache_data = cache_file.read()
-			data = json.loads(cache_data)
+			data = json.loads(cache_data, object_hook = self.decode_value)
 			cache_file.close()
 			return data
 		else:
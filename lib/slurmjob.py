@@ -35,7 +35,7 @@ URL= "https://github.com/megatron-uk/Simple-Slurm-Tools"
 
 # Fields retrieved when getting lists of jobs
 FIELDS_SUMMARY 	= 'User,Account,AllocCPUS,AllocNodes,CPUTimeRaw,Elapsed,JobID,Reserved,\
-NodeList,Partition,Reason,ReqCPUS,ReqMem,ReqNodes,Submit'
+NodeList,Partition,Reason,ReqCPUS,ReqMem,ReqNodes,Submit,QOS,End,State'
 FIELDS_INTEGER 	= ['AllocCPUS', 'AllocNodes', 'ReqCPUS', 'CPUTimeRaw', 'ReqNodes']
 FIELDS_LIST 		= []
 FIELDS 			= 'User,Account,AllocCPUS,AllocNodes,AllocTRES,AssocID,AveCPU,\
@@ -54,6 +54,22 @@ TRESUsageInMinTask,TRESUsageInTot,TRESUsageOutAve,TRESUsageOutMax,TRESUsageOutMa
 TRESUsageOutMaxTask,TRESUsageOutMin,TRESUsageOutMinNode,TRESUsageOutMinTask,\
 TRESUsageOutTot,UID,User,UserCPU,WCKey,WCKeyID,WorkDir'
 FAIL_STATES 		= 'CA,DL,F,NF,PR,RS,RV,TO,OOM'
+# Fields retrieved from squeue for the live queue, and the squeue -O
+# (--Format) string which produces them, '|' separated and unpadded.
+# The memory of a job comes from its TRES, which gives the total memory
+# allocated (or, while pending, requested) whether it was asked for per
+# node or per cpu; the bare MinMemory does not say which
+SQUEUE_FIELDS	= 'User,Account,AllocCPUS,AllocNodes,Elapsed,JobID,NodeList,Partition,Reason,MinMemory,Submit,State,QOS,TRES'
+SQUEUE_FORMAT	= 'UserName:0|,Account:0|,NumCPUs:0|,NumNodes:0|,TimeUsed:0|,JobID:0|,NodeList:0|,Partition:0|,Reason:0|,MinMemory:0|,SubmitTime:0|,State:0|,QOS:0|,tres-alloc:0'
+SQUEUE_JOBID	= SQUEUE_FIELDS.split(',').index('JobID')
+SQUEUE_ELAPSED	= SQUEUE_FIELDS.split(',').index('Elapsed')
+# Map the long state names shown by sacct to the short state codes
+STATE_CODES		= {
+	'BOOT_FAIL' : 'BF', 'CANCELLED' : 'CA', 'COMPLETED' : 'CD', 'COMPLETING' : 'CG',
+	'DEADLINE' : 'DL', 'FAILED' : 'F', 'NODE_FAIL' : 'NF', 'OUT_OF_MEMORY' : 'OOM',
+	'PENDING' : 'PD', 'PREEMPTED' : 'PR', 'RUNNING' : 'R', 'REQUEUED' : 'RQ',
+	'RESIZING' : 'RS', 'REVOKED' : 'RV', 'SUSPENDED' : 'S', 'TIMEOUT' : 'TO',
+}
 
 class SlurmJob():
 	""" Class with methods for working with slurm job details from sacct and scontrol """
@@ -110,7 +126,11 @@ class SlurmJob():
 				hours = int((field.split('-')[1]).split(':')[0])
 				minutes = int((field.split('-')[1]).split(':')[1])
 				seconds = int((field.split('-')[1]).split(':')[2])
-			else:
+			elif field.count(':') == 1:
+				# MM:SS, as shown by squeue for jobs under an hour
+				minutes = int(field.split(':')[0])
+				seconds = int(field.split(':')[1])
+			elif field.count(':') == 2:
 				# HH:MM:SS
 				hours = int(field.split(':')[0])
 				minutes = int(field.split(':')[1])
@@ -152,6 +172,19 @@ class SlurmJob():
 
 		return data
 
+	def tres_memory(self, tres = ""):
+		""" Total memory, in megabytes, of a TRES string such as
+		'cpu=8,mem=16000M,node=2', or 0 if it has no memory """
+
+		units = { 'K' : 1 / 1024, 'M' : 1, 'G' : 1024, 'T' : 1024 * 1024 }
+		for item in tres.split(','):
+			name, _, value = item.partition('=')
+			if name == 'mem' and value:
+				if value[-1] in units:
+					return float(value[:-1]) * units[value[-1]]
+				return float(value)
+		return 0
+
 	def set_rowsummary(self, stdout = None, expand_nodes = False):
 		""" Takes one row of job summary text from an sacct call
 		and maps the columns to dictionary keys.
@@ -195,9 +228,13 @@ class SlurmJob():
 			data['ReservedTime'] = self.field_to_datetime(field = data['Reserved']).total_seconds() / 60
 			data['ElapsedTime'] = self.field_to_datetime(field = data['Elapsed']).total_seconds() / 60
 
+			# Short state code, e.g. 'CANCELLED by 1234' is 'CA'
+			state = data['State'].split(' ')[0].rstrip('+')
+			data['StateCode'] = STATE_CODES.get(state, state)
+
 			# Also generate a 'minutes prior to now' field based on the submission date/time field
 			submitdatetime = datetime.datetime.strptime(data['Submit'], '%Y-%m-%dT%H:%M:%S')
-			data['SubmitMinutes'] = (datetime.datetime.now() - submitdatetime).seconds / 60
+			data['SubmitMinutes'] = (datetime.datetime.now() - submitdatetime).total_seconds() / 60
 
 		except Exception as error:
 			print("Exception while mapping job data!")
@@ -213,6 +250,70 @@ class SlurmJob():
 
 		return data
 
+	def set_squeue_row(self, stdout = None, expand_nodes = False):
+		""" Takes one row of live queue text from an squeue call and maps it
+		to the same dictionary keys as set_rowsummary().
+		Returns the dictionary containing the job fields """
+
+		try:
+
+			data = {}
+			idx = 0
+			stdout_decoded = stdout.decode().split('|')
+			for fieldname in SQUEUE_FIELDS.split(','):
+				data[fieldname] = stdout_decoded[idx]
+				if fieldname in FIELDS_INTEGER:
+					data[fieldname] = int(data[fieldname])
+				idx += 1
+
+			# For pending jobs squeue shows the requested cpus and nodes
+			cpus = data['AllocCPUS']
+			data['ReqCPUS'] = cpus
+			data['ReqNodes'] = data['AllocNodes']
+
+			# The total memory of the job, from its TRES, e.g.
+			# 'cpu=8,mem=16000M,node=2'. MinMemory alone cannot be used, as
+			# squeue does not say whether it is per node (--mem) or per cpu
+			# (--mem-per-cpu). Jobs with no memory in their TRES have none
+			# tracked, and are shown with no memory rather than a guess
+			data['ReqMem'] = ''
+			data['MemoryPerCore'] = 0
+			total_memory = self.tres_memory(data['TRES'])
+			if total_memory and cpus > 0 and data['AllocNodes'] > 0:
+				data['ReqMem'] = f"{total_memory / data['AllocNodes']:.0f}Mn"
+				data['MemoryPerCore'] = total_memory / cpus
+			data['TotalMemory'] = cpus * data['MemoryPerCore']
+
+			if expand_nodes and data['NodeList']:
+				data['NodeList'] = self.expand_nodelist(nodelist = data['NodeList'])
+
+			data['Reserved'] = ''
+			data['ReservedTime'] = 0
+			data['End'] = 'Unknown'
+			if data['Elapsed'] == 'INVALID':
+				data['Elapsed'] = '0:00'
+			data['ElapsedTime'] = self.field_to_datetime(field = data['Elapsed']).total_seconds() / 60
+			data['CPUTimeRaw'] = int(cpus * data['ElapsedTime'] * 60)
+
+			data['StateCode'] = STATE_CODES.get(data['State'], data['State'])
+
+			submitdatetime = datetime.datetime.strptime(data['Submit'], '%Y-%m-%dT%H:%M:%S')
+			data['SubmitMinutes'] = (datetime.datetime.now() - submitdatetime).total_seconds() / 60
+
+		except Exception as error:
+			print("Exception while mapping live queue data!")
+			print(f"Exception was {error}")
+			print(traceback.format_exc())
+			print("")
+			if 'JobID' in data:
+				print(f"The above entry for job [{data['JobID']}] will be IGNORED...")
+			else:
+				print("The above entry will be IGNORED...")
+
+			return False
+
+		return data
+
 	def setrow(self, row = 0, stdout = None):
 		""" Takes one row of text output from an sacct call and maps
 		the columns to dictionary keys.
@@ -269,17 +370,19 @@ class SlurmJob():
 			# Otherwise record this as a component of the the job
 			self.subjobs.append(data)
 
-	def get_by(self, job_cmd = "", expand_nodes = False):
-		""" Get job data """
+	def get_by(self, job_cmd = "", expand_nodes = False, cache = True):
+		""" Get job data. Set cache to False for live queue data, which
+		must not be answered from (or stored to) the persistent cache. """
 
 		try:
 			jobs = []
 			
 			# Are the results of this job cmd previously cached?
-			res = self.sc.loadcmd(key = job_cmd)
-			# Yes - retrieve it
-			if res:
-				return res
+			if cache:
+				res = self.sc.loadcmd(key = job_cmd)
+				# Yes - retrieve it
+				if res:
+					return res
 				
 			# No - run the cmd			
 			process = subprocess.Popen(job_cmd, shell=True,
@@ -294,7 +397,8 @@ class SlurmJob():
 							jobs.append(outdata)
 							
 					# Store the results
-					self.sc.storecmd(key = job_cmd, data = jobs)
+					if cache:
+						self.sc.storecmd(key = job_cmd, data = jobs)
 			else:
 				return False
 		except Exception as error:
@@ -305,8 +409,63 @@ class SlurmJob():
 
 		return jobs
 
-	def get_bystate(self, state = None, start = None, end = None, expand_nodes = False):
-		""" Return all of the jobs in a given state across all partitions """
+	def iter_by(self, job_cmd = "", expand_nodes = False):
+		""" Get job data as a stream, yielding each job as its row is read
+		from the command, rather than building the whole list in memory.
+		Previously cached results for the command are yielded instead,
+		if available. """
+
+		res = self.sc.loadcmd(key = job_cmd)
+		if res:
+			for outdata in res:
+				yield outdata
+			return
+
+		try:
+			process = subprocess.Popen(job_cmd, shell=True,
+				stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+				stderr=subprocess.STDOUT)
+		except Exception as error:
+			print(f"Exception making subprocess call for job cmd [{job_cmd}]")
+			print(f"Exception was {error}")
+			print(traceback.format_exc())
+			return
+
+		# First line are the field headers
+		process.stdout.readline()
+		for line in process.stdout:
+			line = line.rstrip(b'\n')
+			if len(line) > 0:
+				outdata = self.set_rowsummary(stdout = line, expand_nodes = expand_nodes)
+				if outdata:
+					yield outdata
+		process.wait()
+
+	def iter_rows(self, job_cmd = ""):
+		""" Stream the raw rows of an sacct command, without mapping them
+		to job dictionaries. Rows can be mapped later, if needed, with
+		set_rowsummary(). """
+
+		try:
+			process = subprocess.Popen(job_cmd, shell=True,
+				stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+				stderr=subprocess.STDOUT)
+		except Exception as error:
+			print(f"Exception making subprocess call for job cmd [{job_cmd}]")
+			print(f"Exception was {error}")
+			print(traceback.format_exc())
+			return
+
+		# First line are the field headers
+		process.stdout.readline()
+		for line in process.stdout:
+			line = line.rstrip(b'\n')
+			if len(line) > 0:
+				yield line
+		process.wait()
+
+	def bystate_cmd(self, state = None, start = None, end = None):
+		""" Build the sacct command to find jobs in a given state across all partitions """
 
 		# If looking for failed jobs, expand the criteria to all 'abnormal' codes
 		if state == 'F':
@@ -315,9 +474,21 @@ class SlurmJob():
 			job_cmd = f"sacct -X -p -a -S {start} -E {end} --state={state} --format={FIELDS_SUMMARY}"
 		else:
 			job_cmd = f"sacct -X -p -a --state={state} --format={FIELDS_SUMMARY}"
+		return job_cmd
+
+	def get_bystate(self, state = None, start = None, end = None, expand_nodes = False):
+		""" Return all of the jobs in a given state across all partitions """
+
+		job_cmd = self.bystate_cmd(state, start, end)
 		jobs = self.get_by(job_cmd, expand_nodes)
 		return jobs
 
+	def iter_bystate(self, state = None, start = None, end = None, expand_nodes = False):
+		""" Stream all of the jobs in a given state across all partitions """
+
+		job_cmd = self.bystate_cmd(state, start, end)
+		return self.iter_by(job_cmd, expand_nodes)
+
 	def get_bynode(self, hostname = None, expand_nodes = False):
 		""" Return all of the jobs currently on a given node """
 
@@ -332,6 +503,105 @@ class SlurmJob():
 		jobs = self.get_by(job_cmd, expand_nodes)
 		return jobs
 
+	def get_bypartitions(self, partitions = None, states = ['R', 'PD'], expand_nodes = False):
+		""" Return all of the jobs on a list of partitions (or every partition,
+		if none are given) in any of a list of slurm state codes, using a
+		single sacct call. The jobs are split locally by partition and state:
+			{ 'partition1' : { 'R' : [...], 'PD' : [...] }, 'partition2' : ... }
+		"""
+
+		if partitions:
+			job_cmd = f"sacct -X -p -a --partition={','.join(partitions)} --state={','.join(states)} --format={FIELDS_SUMMARY}"
+		else:
+			job_cmd = f"sacct -X -p -a --state={','.join(states)} --format={FIELDS_SUMMARY}"
+		jobs = self.get_by(job_cmd, expand_nodes, cache = False)
+		if jobs is False:
+			return False
+
+		data = {}
+		if partitions:
+			for partition in partitions:
+				data[partition] = {}
+				for state in states:
+					data[partition][state] = []
+
+		for job in jobs:
+			if job['Partition'] not in data:
+				data[job['Partition']] = {}
+				for state in states:
+					data[job['Partition']][state] = []
+			if job['StateCode'] in data[job['Partition']]:
+				data[job['Partition']][job['StateCode']].append(job)
+
+		return data
+
+	def get_live_rows(self, partitions = None, states = ['R', 'PD']):
+		""" Return the raw rows of the live queue held by slurmctld, for a list
+		of partitions (or every partition) in any of a list of slurm state
+		codes, via a single squeue call. Rows can be mapped with
+		set_squeue_row(). Returns False if squeue could not be run. """
+
+		job_cmd = f"squeue --noheader -a -t {','.join(states)} -O '{SQUEUE_FORMAT}'"
+		if partitions:
+			job_cmd += f" -p {','.join(partitions)}"
+
+		try:
+			process = subprocess.run(job_cmd, shell=True,
+				stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+				stderr=subprocess.DEVNULL)
+			if process.returncode != 0:
+				return False
+		except Exception as error:
+			print(f"Exception making subprocess call for job cmd [{job_cmd}]")
+			print(f"Exception was {error}")
+			return False
+
+		rows = []
+		for line in process.stdout.split(b'\n'):
+			if len(line) > 0:
+				rows.append(line)
+		return rows
+
+	def live_row_key(self, stdout = None):
+		""" Return the job id of a raw squeue row, and a signature of the row
+		which ignores the elapsed time. The signature only changes when
+		something other than the passing of time has changed for the job. """
+
+		fields = stdout.split(b'|')
+		jobid = fields[SQUEUE_JOBID].decode()
+		signature = b'|'.join(fields[:SQUEUE_ELAPSED] + fields[SQUEUE_ELAPSED + 1:])
+		return jobid, signature
+
+	def get_live(self, partitions = None, states = ['R', 'PD'], expand_nodes = False):
+		""" Return all of the jobs on a list of partitions (or every partition)
+		in any of a list of slurm state codes, from the live queue held by
+		slurmctld via squeue. This is much lighter than asking slurmdbd via
+		sacct. The jobs are split by partition and state in the same way as
+		get_bypartitions(). Returns False if squeue could not be run. """
+
+		rows = self.get_live_rows(partitions, states)
+		if rows is False:
+			return False
+
+		data = {}
+		if partitions:
+			for partition in partitions:
+				data[partition] = {}
+				for state in states:
+					data[partition][state] = []
+
+		for line in rows:
+			job = self.set_squeue_row(stdout = line, expand_nodes = expand_nodes)
+			if job:
+				if job['Partition'] not in data:
+					data[job['Partition']] = {}
+					for state in states:
+						data[job['Partition']][state] = []
+				if job['StateCode'] in data[job['Partition']]:
+					data[job['Partition']][job['StateCode']].append(job)
+
+		return data
+
 	def get_details(self, jobid = None):
 		""" Return the top-level information for a specific job - this only
 		returns a single entry, use 'getAll()' to return sub-components """
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""
+Simple Slurm Tools
+Copyright (C) 2024 John Snowdon
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import subprocess
+import traceback
+
+# Fields retrieved from sinfo for each node, and the sinfo format string
+# which produces them. CPUState is 'allocated/idle/other/total'.
+NODE_FIELDS	= 'NodeName,CPUs,CPUState,RealMemory,FreeMem,CPULoad,State,Partition'
+NODE_FORMAT	= '%n|%c|%C|%m|%e|%O|%T|%P'
+
+# Node states which mean the node cannot currently run jobs
+NODE_DOWN_STATES = ['down', 'drained', 'draining', 'fail', 'failing', 'future', 'maint', 'not_responding', 'power_down', 'powered_down', 'unknown']
+
+class SlurmNode():
+	""" Class with methods for working with slurm node details from sinfo """
+
+	def __init__(self, debug = False):
+		self.debug = debug
+		self.nodes = None
+
+	def to_number(self, field = "", number_type = int):
+		""" sinfo shows N/A for figures a node has not reported """
+		try:
+			return number_type(field)
+		except ValueError:
+			return 0
+
+	def set_noderow(self, stdout = None):
+		""" Takes one row of text output from an sinfo call and maps it to a
+		dictionary using the field names in NODE_FIELDS.
+		Returns the dictionary containing the node fields """
+
+		try:
+			data = {}
+			idx = 0
+			stdout_decoded = stdout.decode().split('|')
+			for fieldname in NODE_FIELDS.split(','):
+				data[fieldname] = stdout_decoded[idx]
+				idx += 1
+
+			data['CPUs'] = self.to_number(data['CPUs'])
+			cpu_state = data['CPUState'].split('/')
+			data['CPUsAllocated'] = self.to_number(cpu_state[0])
+			data['CPUsIdle'] = self.to_number(cpu_state[1])
+			data['CPUsOther'] = self.to_number(cpu_state[2])
+			data['RealMemory'] = self.to_number(data['RealMemory'])
+			data['FreeMem'] = self.to_number(data['FreeMem'])
+			data['CPULoad'] = self.to_number(data['CPULoad'], float)
+			data['Partitions'] = [data['Partition'].rstrip('*')]
+			data['Available'] = data['State'].rstrip('*~#!%$@^-+').lower() not in NODE_DOWN_STATES
+
+		except Exception as error:
+			print("Exception while mapping node data!")
+			print(f"Exception was {error}")
+			print(traceback.format_exc())
+			return False
+
+		return data
+
+	def refresh(self):
+		""" Read the current details of every node with a single sinfo call.
+		Nodes in several partitions are listed once per partition by sinfo,
+		so they are merged here. Returns False if sinfo could not be run. """
+
+		node_cmd = f"sinfo -N --noheader -o '{NODE_FORMAT}'"
+		try:
+			process = subprocess.run(node_cmd, shell=True,
+				stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+				stderr=subprocess.DEVNULL)
+			if process.returncode != 0:
+				return False
+		except Exception as error:
+			print(f"Exception making subprocess call for node cmd [{node_cmd}]")
+			print(f"Exception was {error}")
+			return False
+
+		nodes = {}
+		for line in process.stdout.split(b'\n'):
+			if len(line) > 0:
+				node = self.set_noderow(stdout = line)
+				if node:
+					if node['NodeName'] in nodes:
+						nodes[node['NodeName']]['Partitions'] += node['Partitions']
+					else:
+						nodes[node['NodeName']] = node
+
+		self.nodes = nodes
+		return nodes
+
+	def getNodes(self):
+		""" Return a list of all node names """
+
+		if self.nodes is None:
+			self.refresh()
+		if not self.nodes:
+			return []
+		return sorted(self.nodes.keys())
+
+	def getNode(self, hostname = None):
+		""" Return the details of a single node """
+
+		if self.nodes is None:
+			self.refresh()
+		if not self.nodes:
+			return False
+		return self.nodes.get(hostname, False)
+
+	def new_total(self):
+		""" An empty set of utilisation totals for a group of nodes """
+		return { 'nodes' : 0, 'nodes_available' : 0, 'cpus' : 0, 'cpus_allocated' : 0, 'utilisation_pc' : 0 }
+
+	def get_utilisation(self):
+		""" Current core and memory utilisation of every node, and totals for
+		every partition and the cluster as a whole:
+			{ 'nodes' : { name : {...} }, 'partitions' : { name : {...} }, 'cluster' : {...} }
+		Returns False if sinfo could not be run. """
+
+		nodes = self.refresh()
+		if nodes is False:
+			return False
+
+		utilisation = {
+			'nodes' : {},
+			'partitions' : {},
+			'cluster' : self.new_total(),
+		}
+
+		for name, node in nodes.items():
+			n = {
+				'cpus' : node['CPUs'],
+				'cpus_allocated' : node['CPUsAllocated'],
+				'cpus_idle' : node['CPUsIdle'],
+				'memory' : node['RealMemory'],
+				'memory_free' : node['FreeMem'],
+				'load' : node['CPULoad'],
+				'available' : node['Available'],
+				'utilisation_pc' : 0,
+			}
+			if n['cpus'] > 0:
+				n['utilisation_pc'] = (n['cpus_allocated'] / n['cpus']) * 100
+			utilisation['nodes'][name] = n
+
+			totals = [utilisation['cluster']]
+			for partition in node['Partitions']:
+				if partition not in utilisation['partitions']:
+					utilisation['partitions'][partition] = self.new_total()
+				totals.append(utilisation['partitions'][partition])
+			for total in totals:
+				total['nodes'] += 1
+				if n['available']:
+					total['nodes_available'] += 1
+				total['cpus'] += n['cpus']
+				total['cpus_allocated'] += n['cpus_allocated']
+
+		for total in [utilisation['cluster']] + list(utilisation['partitions'].values()):
+			if total['cpus'] > 0:
+				total['utilisation_pc'] = (total['cpus_allocated'] / total['cpus']) * 100
+
+		return utilisation
@@ -23,10 +23,31 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # A class for generating statistics from Slurm job data.
 #
 #############################################################
-		
+
+import concurrent.futures
+import datetime
+from array import array
+
 from lib.slurmcache import slurmCache
+from lib.slurmjob import SlurmJob
+from lib.slurmnode import SlurmNode
 import lib.settings as settings
-		
+
+# Largest per-node core count which fits in the node usage array
+USAGE_MAX = 65535
+
+# Per-process instance used by the generate_stats_days worker pool
+_worker_stats = None
+
+def _init_worker_stats():
+	""" Process pool initialiser: create one stats instance per worker process. """
+	global _worker_stats
+	_worker_stats = SlurmStatsOLD()
+
+def _generate_day_stats(year, month, day, hours, minutes):
+	""" Process pool worker: generate the stats for a single day. """
+	return _worker_stats.generate_stats(year, month, day, hours, minutes)
+
 class SlurmStats():
 	
 	def __init__(self):
@@ -40,9 +61,12 @@ class SlurmStatsOLD():
 	
 	def __init__(self):
 		# Initialise the class, if needed
-		print("Initialising slurmDB Integration class")
 		self.debug = settings.DEBUG
+		if self.debug:
+			print("Initialising slurmDB Integration class")
 		self.slurmcache = slurmCache()
+		self.slurmjob = SlurmJob(debug = self.debug)
+		self.slurmnode = SlurmNode()
 
 	def generate_stats(self, year = 2023, month = 1, day = 1, hours = [], minutes = []):
 		""" Generate stats for a given day - using the hour/minutes granularity given. """
@@ -89,8 +113,8 @@ class SlurmStatsOLD():
 				minute_ = minute[0].split(':')[0]
 				minute_ += ":01"
 		
-				start_snapshot_time = current_year + "-" + current_month + "-" + current_day + hour[0] + ":" + minute[0]
-				end_snapshot_time = current_year + "-" + current_month + "-" + current_day + hour[0] + ":" + minute_
+				start_snapshot_time = current_year + "-" + current_month + "-" + current_day + "T" + hour[0] + ":" + minute[0]
+				end_snapshot_time = current_year + "-" + current_month + "-" + current_day + "T" + hour[0] + ":" + minute_
 				
 				if self.debug:
 					print("- %s to %s [snapshot]" % (start_snapshot_time, end_snapshot_time))
@@ -109,7 +133,7 @@ class SlurmStatsOLD():
 					for q in settings.PARTITIONS:
 						stat_data_snapshot[q] = { 'cores' : 0 }
 						
-					stat_data_snapshot['jobs_running'] = self.slurmjob.getByState(state = 'R', start = start_snapshot_time, end = end_snapshot_time, expand_nodes = True)
+					stat_data_snapshot['jobs_running'] = self.slurmjob.get_bystate(state = 'R', start = start_snapshot_time, end = end_snapshot_time, expand_nodes = True)
 					
 					# Count total number of cpu cores in use at this moment
 					for j in stat_data_snapshot['jobs_running']:
@@ -141,8 +165,8 @@ class SlurmStatsOLD():
 				#
 				###########################################################
 				
-				start_time = current_year + "-" + current_month + "-" + current_day + hour[0] + ":" + minute[0]
-				end_time = current_year + "-" + current_month + "-" + current_day + hour[1] + ":" + minute[1]
+				start_time = current_year + "-" + current_month + "-" + current_day + "T" + hour[0] + ":" + minute[0]
+				end_time = current_year + "-" + current_month + "-" + current_day + "T" + hour[1] + ":" + minute[1]
 				
 				if self.debug:
 					print("- %s to %s" % (start_time, end_time))
@@ -206,19 +230,19 @@ class SlurmStatsOLD():
 					# Node status
 		
 					# Total jobs that were running
-					stat_data['jobs_running'] = self.slurmjob.getByState(state = 'R', start = start_time, end = end_time, expand_nodes = False)
+					stat_data['jobs_running'] = self.slurmjob.get_bystate(state = 'R', start = start_time, end = end_time, expand_nodes = False)
 					stat_data['jobs_running_total'] = len(stat_data['jobs_running'])
 					
 					# Total jobs that were pending
-					#stat_data['jobs_pending'] = sj.getByState(state = 'PD', start = start_time, end = end_time, expand_nodes = False)
+					#stat_data['jobs_pending'] = self.slurmjob.get_bystate(state = 'PD', start = start_time, end = end_time, expand_nodes = False)
 					#stat_data['jobs_pending_total'] = len(stat_data['jobs_pending'])
 					
 					# Total jobs that finished in this period
-					stat_data['jobs_completed'] = self.slurmjob.getByState(state = 'CD', start = start_time, end = end_time, expand_nodes = False)
+					stat_data['jobs_completed'] = self.slurmjob.get_bystate(state = 'CD', start = start_time, end = end_time, expand_nodes = False)
 					stat_data['jobs_completed_total'] = len(stat_data['jobs_completed'])
 					
 					# Total jobs that failed in this period
-					stat_data['jobs_failed'] = self.slurmjob.getByState(state = 'F', start = start_time, end = end_time, expand_nodes = False)
+					stat_data['jobs_failed'] = self.slurmjob.get_bystate(state = 'F', start = start_time, end = end_time, expand_nodes = False)
 					stat_data['jobs_failed_total'] = len(stat_data['jobs_failed'])
 	
 					# Update partition totals				
@@ -377,8 +401,82 @@ class SlurmStatsOLD():
 			print("- All Done")
 		return stats
 
-	def generate_summary(self, stats = []):
-		""" Generate a summary dict using a stats list """
+	def day_list(self, end_date = None, days = settings.MONTH_DAYS):
+		""" The dates of a run of days ending on end_date, oldest first """
+
+		day_list = []
+		for i in range(days - 1, -1, -1):
+			day_list.append(end_date - datetime.timedelta(days = i))
+		return day_list
+
+	def day_cache_files(self, end_date = None, days = settings.MONTH_DAYS, hours = [], minutes = []):
+		""" The persistent cache files which generate_stats_days() keeps the
+		days of a run in, whether or not they have been generated yet """
+
+		files = []
+		for d in self.day_list(end_date, days):
+			files.append(self.slurmcache.filename(d.year, d.month, d.day, hours, minutes, "generate_stats_day"))
+		return files
+
+	def generate_stats_days(self, end_date = None, days = settings.MONTH_DAYS, hours = [], minutes = [], workers = settings.STATS_WORKERS):
+		""" Generate stats for a run of days ending on end_date (default today),
+		using the hour/minutes granularity given.
+		Days are independent of each other, so any which are not already in
+		the persistent cache are spread across a pool of worker processes.
+		Each completed day is written to the cache and the days are merged
+		back together in date order. """
+
+		if end_date is None:
+			end_date = datetime.date.today()
+
+		day_list = self.day_list(end_date, days)
+
+		day_stats = {}
+		missing = []
+		for d in day_list:
+			cached = self.slurmcache.load(d.year, d.month, d.day, hours, minutes, "generate_stats_day")
+			if cached:
+				day_stats[d] = cached
+			else:
+				missing.append(d)
+
+		if self.debug:
+			print("Generating stats for %d days (%d cached) using %d workers" % (len(day_list), len(day_list) - len(missing), workers))
+
+		if missing:
+			with concurrent.futures.ProcessPoolExecutor(max_workers = workers, initializer = _init_worker_stats) as executor:
+				futures = {}
+				for d in missing:
+					futures[executor.submit(_generate_day_stats, d.year, d.month, d.day, hours, minutes)] = d
+
+				for future in concurrent.futures.as_completed(futures):
+					d = futures[future]
+					day_stats[d] = future.result()
+					if self.debug:
+						print("- %s done" % d)
+
+					# Today is still in progress, so don't cache it as a complete day
+					if d != datetime.date.today():
+						self.slurmcache.store(d.year, d.month, d.day, hours, minutes, "generate_stats_day", day_stats[d])
+
+		# Merge in date order
+		stats = []
+		for d in day_list:
+			stats += day_stats[d]
+
+		if self.debug:
+			print("- All Done")
+		return stats
+
+	def generate_summary(self, stats = [], verbose = False):
+		""" Generate a summary dict using a stats list; the median figures
+		are printed as they are found if verbose is set.
+		The cores used on every node at every sample point are returned in
+		summary['node_usage'], a flat nodes x slots array('H') (see
+		node_usage_row()); slurmCache stores the arrays as base64 bytes.
+		This replaces the per-node 'cores_used' and 'cores_free' lists of
+		summary['node_details'] and today['use_list'], which are no longer
+		produced; the total of today['use_list'] is today['use_total']. """
 
 		summary = {}
 		
@@ -388,17 +486,31 @@ class SlurmStatsOLD():
 		all_nodes = self.slurmnode.getNodes()
 		all_node_data = {}
 		total_cores_available = 0
+		node_ids = {}
+		node_cpus = array('H')
 		for n in all_nodes:
 			node_data = self.slurmnode.getNode(hostname = n)
-
-			# Add empty lists to record used/free cores at each sample point
-			node_data['cores_used'] = []
-			node_data['cores_free'] = []
 			all_node_data[n] = node_data
 			
+			# Each node gets a row in the node usage array
+			node_ids[n] = len(node_cpus)
+			node_cpus.append(min(node_data['CPUs'], USAGE_MAX))
+			
 			# Add this nodes total cores to the total available for the cluster			
 			total_cores_available += node_data['CPUs']
 			
+		# Cores used on every node at every sample point, stored as one
+		# flat nodes x slots array rather than a list per node
+		slots = len(stats)
+		node_usage = {
+			'nodes' : list(node_ids.keys()),
+			'node_ids' : node_ids,
+			'slots' : slots,
+			'cpus' : node_cpus,
+			'cores_used' : array('H', [0]) * (len(node_cpus) * slots),
+		}
+		cores_used_array = node_usage['cores_used']
+			
 		if self.debug:
 			print("- Done")
 			
@@ -451,33 +563,20 @@ class SlurmStatsOLD():
 			'use_max_pc' : 0,
 			'use_median' : 0,
 			'use_median_pc' : 0,
-			'use_list' : [],
+			'use_total' : 0,
+			'fragmentation_pc' : 0,
 		}
-		for s in stats:
+		for slot, s in enumerate(stats):
 						
+			# Only nodes which were in use at this sample period appear in
+			# the snapshot, every other node keeps its zero entry
 			period_cores_use = 0
-			s['use_list'] = []
-			for n in all_nodes:
-				
-				# Was this node in use at this sample period
-				if n in s['snapshot']['nodes']:
-					# Yes, add the number of cores in use
-					cores_used = s['snapshot']['nodes'][n]['cores'] 
-				else:
-					# No, so set cores in use as 0
-					cores_used = 0
-					
-				all_node_data[n]['cores_used'].append(cores_used)
-				
-				cores_free = all_node_data[n]['CPUs'] - cores_used
-				if cores_free < 0:
-					all_node_data[n]['cores_free'].append(0)
-				else:
-					all_node_data[n]['cores_free'].append(cores_free)
-					
-				# Record cores used
-				s['use_list'].append(cores_used)
-				period_cores_use += cores_used
+			for n in s['snapshot']['nodes']:
+				if n in node_ids:
+					cores_used = min(s['snapshot']['nodes'][n]['cores'], USAGE_MAX)
+					cores_used_array[(node_ids[n] * slots) + slot] = cores_used
+					period_cores_use += cores_used
+			s['use_total'] = period_cores_use
 				
 			# update max/min total core use for this sample period
 			if period_cores_use > today['use_max']:
@@ -559,28 +658,31 @@ class SlurmStatsOLD():
 			today['mem_core_list'] += s['mem_core_list']
 			today['cpu_time_list'] += s['cpu_time_list']
 			today['nodes_list'] += s['nodes_list']
-			today['use_list'] += s['use_list']
+			today['use_total'] += s['use_total']
 		
 		# Median value for todays core counts
 		for v in today['cores_list']:
 			today['cores_median'] += v
 		if len(today['cores_list']) > 0:
 			today['cores_median'] = today['cores_median'] / len(today['cores_list'])
-		print("- Median Cores per job in this period: %d" % (today['cores_median']))
+		if verbose:
+			print("- Median Cores per job in this period: %d" % (today['cores_median']))
 		
 		# Median value for todays mem-per-core counts
 		for v in today['mem_core_list']:
 			today['mem_core_median'] += v
 		if len(today['mem_core_list']) > 0:
 			today['mem_core_median'] = today['mem_core_median'] / len(today['mem_core_list'])
-		print("- Median Mem per core in this period: %d" % (today['mem_core_median']))
+		if verbose:
+			print("- Median Mem per core in this period: %d" % (today['mem_core_median']))
 		
 		# Median value for todays mem-per-job counts
 		for v in today['mem_job_list']:
 			today['mem_job_median'] += v
 		if len(today['mem_job_list']) > 0:
 			today['mem_job_median'] = today['mem_job_median'] / len(today['mem_job_list'])
-		print("- Median Mem per job in this period: %d" % (today['mem_job_median']))
+		if verbose:
+			print("- Median Mem per job in this period: %d" % (today['mem_job_median']))
 		
 		# Median value for todays cputime counts
 		for v in today['cpu_time_list']:
@@ -588,21 +690,22 @@ class SlurmStatsOLD():
 			today['cpu_time_median'] += v
 		if len(today['cpu_time_list']) > 0:
 			today['cpu_time_median'] = today['cpu_time_median'] / len(today['cpu_time_list'])
-		print("- Median CPU time per job in this period: %d" % (today['cpu_time_median']))
+		if verbose:
+			print("- Median CPU time per job in this period: %d" % (today['cpu_time_median']))
 		
 		# Median value for todays node counts
 		for v in today['nodes_list']:
 			today['nodes_median'] += v
 		if len(today['nodes_list']) > 0:
 			today['nodes_median'] = today['nodes_median'] / len(today['nodes_list'])
-		print("- Median Nodes per job in this period: %d" % (today['nodes_median']))
+		if verbose:
+			print("- Median Nodes per job in this period: %d" % (today['nodes_median']))
 		
 		# Median value for todays utilisation
-		for v in today['use_list']:
-			today['use_median'] += v
-		if len(today['use_list']) > 0:
-			today['use_median'] = (today['use_median'] / (total_cores_available * len(stats))) * total_cores_available
-		print("- Median CPU cores in use across in this period: %d" % (today['use_median']))
+		if len(stats) > 0:
+			today['use_median'] = today['use_total'] / len(stats)
+		if verbose:
+			print("- Median CPU cores in use across in this period: %d" % (today['use_median']))
 		
 		if total_cores_available > 0:
 			today['use_median_pc'] = (today['use_median'] / total_cores_available) * 100
@@ -639,6 +742,12 @@ class SlurmStatsOLD():
 			idx = int(len(today['cpu_time_list']) * 0.75)
 			today['cpu_time_75'] = today['cpu_time_list'][idx]
 		
+		# Per-node duty cycle, busiest/idlest nodes and fragmentation
+		node_metrics = self.node_usage_metrics(node_usage)
+		for n in node_metrics['nodes']:
+			all_node_data[n['node']].update(n)
+		today['fragmentation_pc'] = node_metrics['fragmentation_pc']
+		
 		if self.debug:
 			print("- Done")
 		
@@ -728,6 +837,9 @@ class SlurmStatsOLD():
 			print("- Done")
 			
 		summary['node_details'] = all_node_data
+		summary['node_usage'] = node_usage
+		summary['busiest_nodes'] = node_metrics['busiest_nodes']
+		summary['idlest_nodes'] = node_metrics['idlest_nodes']
 		summary['today'] = today
 		summary['user_job_details'] = user_job_details
 		summary['job_list'] = job_list
@@ -746,4 +858,69 @@ class SlurmStatsOLD():
 		if self.debug:
 			print("- All Done")
 
-		return summary
\ No newline at end of file
+		return summary
+
+	def node_usage_row(self, node_usage = None, node = ""):
+		""" Cores used on one node at every sample point, from the node_usage
+		of a summary; the cores free are node_usage['cpus'] of the node less
+		these. Returns an empty list for a node which is not in the summary. """
+
+		if node not in node_usage['node_ids']:
+			return []
+		idx = node_usage['node_ids'][node]
+		slots = node_usage['slots']
+		return list(node_usage['cores_used'][idx * slots:(idx + 1) * slots])
+
+	def node_usage_metrics(self, node_usage = None):
+		""" Derive per-node and cluster-wide metrics from a nodes x slots
+		node usage array, as built by generate_summary().
+		Each node's row is contiguous, so the per-node figures come from
+		slice sums and counts rather than a loop over every sample. """
+
+		nodes = []
+		slots = node_usage['slots']
+		cores_used = node_usage['cores_used']
+		total_free = 0
+		fragmented_free = 0
+
+		for idx, n in enumerate(node_usage['nodes']):
+			cpus = node_usage['cpus'][idx]
+			row = cores_used[idx * slots:(idx + 1) * slots]
+			used = sum(row)
+			idle_slots = row.count(0)
+			capacity = cpus * slots
+
+			node = {
+				'node' : n,
+				'cores_used_total' : used,
+				'cores_used_mean' : 0,
+				'cores_used_max' : 0,
+				'utilisation_pc' : 0,
+				'duty_cycle_pc' : 0,
+			}
+			if slots > 0:
+				node['cores_used_mean'] = used / slots
+				node['cores_used_max'] = max(row)
+				node['duty_cycle_pc'] = ((slots - idle_slots) / slots) * 100
+			if capacity > 0:
+				node['utilisation_pc'] = (used / capacity) * 100
+			nodes.append(node)
+
+			# Free cores on a node which is partly in use can only be given to
+			# jobs which fit in the gap, so count them as fragmented
+			free = max(capacity - used, 0)
+			total_free += free
+			fragmented_free += max(free - (cpus * idle_slots), 0)
+
+		by_use = sorted(nodes, key=lambda x: x['utilisation_pc'], reverse=True)
+
+		metrics = {
+			'nodes' : nodes,
+			'busiest_nodes' : by_use[0:settings.LEAGUE_TABLE_SIZE],
+			'idlest_nodes' : list(reversed(by_use))[0:settings.LEAGUE_TABLE_SIZE],
+			'fragmentation_pc' : 0,
+		}
+		if total_free > 0:
+			metrics['fragmentation_pc'] = (fragmented_free / total_free) * 100
+
+		return metrics
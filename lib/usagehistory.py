@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+"""
+Simple Slurm Tools
+Copyright (C) 2024 John Snowdon
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#####################################################################
+#
+# An append-only history of the disk use reported by diskrep.
+#
+# Each filesystem, report type (users or groups) and method (quota,
+# find or ls) has its own file of fixed-width binary records, one per
+# user or group per run, appended in date order. A trend over the
+# last N days finds its first record with a binary search on the
+# date, and only reads from there to the end of the file.
+#
+#####################################################################
+
+import datetime
+import hashlib
+import mmap
+import os
+import struct
+
+import lib.settings as settings
+from lib.posix import get_uid, get_gid, get_username, get_groupname
+
+# One record: day (date ordinal), uid or gid, kbytes used, kbytes limit, files
+RECORD = struct.Struct('<IIqqq')
+
+class UsageHistory():
+	""" Record and read back the disk use of users and groups over time """
+
+	def __init__(self, path = settings.CACHE_PATH):
+		self.path = path
+
+	def filename(self, dir_name = "/mydir", kind = "users", method = "quota"):
+		""" The history file of one filesystem, report type and method """
+
+		key = hashlib.md5(os.path.realpath(dir_name).encode('utf-8')).hexdigest()
+		return self.path + "/usage-" + key + "-" + kind + "-" + method + ".dat"
+
+	def store(self, dir_name = "/mydir", kind = "users", method = "quota", reports = None, day = None):
+		""" Append one record for every user (kind 'users') or group (kind
+		'groups') in a list of diskrep reports, dated today unless a
+		datetime.date is given. Returns the number of records written. """
+
+		if day is None:
+			day = datetime.date.today()
+
+		records = []
+		for r in reports:
+			if kind == "groups":
+				owner = get_gid(r['group'])
+			else:
+				owner = get_uid(r['username'])
+			if owner is None:
+				continue
+			records.append(RECORD.pack(day.toordinal(), owner, int(r['quota']), int(r['limit']), int(r.get('files', 0))))
+
+		if records:
+			if not os.path.exists(self.path):
+				os.makedirs(self.path)
+			with open(self.filename(dir_name, kind, method), 'ab') as history_file:
+				history_file.write(b"".join(records))
+		return len(records)
+
+	def first_record(self, m = None, count = 0, since_day = 0):
+		""" Binary search for the first record on or after since_day """
+
+		low = 0
+		high = count
+		while low < high:
+			mid = (low + high) // 2
+			if RECORD.unpack_from(m, mid * RECORD.size)[0] < since_day:
+				low = mid + 1
+			else:
+				high = mid
+		return low
+
+	def load(self, dir_name = "/mydir", kind = "users", method = "quota", since_day = 0):
+		""" Read the records on or after since_day (a date ordinal):
+			{ owner : { day : (kbytes, limit, files) } }
+		A later record for the same owner and day replaces an earlier one. """
+
+		history = {}
+		history_filename = self.filename(dir_name, kind, method)
+		if not os.path.exists(history_filename):
+			return history
+
+		with open(history_filename, 'rb') as history_file:
+			# Ignore a partly written record at the end of the file
+			count = os.fstat(history_file.fileno()).st_size // RECORD.size
+			if count == 0:
+				return history
+			with mmap.mmap(history_file.fileno(), 0, access = mmap.ACCESS_READ) as m:
+				start = self.first_record(m, count, since_day)
+				for day, owner, kbytes, limit, files in RECORD.iter_unpack(m[start * RECORD.size:count * RECORD.size]):
+					if owner not in history:
+						history[owner] = {}
+					history[owner][day] = (kbytes, limit, files)
+		return history
+
+	def growth(self, points = None):
+		""" Least squares slope of a list of (day, kbytes); kbytes per day """
+
+		n = len(points)
+		if n < 2:
+			return 0
+		mean_day = sum([p[0] for p in points]) / n
+		mean_kbytes = sum([p[1] for p in points]) / n
+		top = 0
+		bottom = 0
+		for day, kbytes in points:
+			top += (day - mean_day) * (kbytes - mean_kbytes)
+			bottom += (day - mean_day) ** 2
+		if bottom == 0:
+			return 0
+		return top / bottom
+
+	def trend(self, dir_name = "/mydir", kind = "users", method = "quota", days = settings.TREND_DAYS, names = None):
+		""" Growth of every user or group (or just those in names) over the
+		last 'days' days, and the days left until each fills its quota at
+		that rate. Returns a list of reports, in the form:
+			{ 'username' or 'group', 'dirname', 'quota', 'limit', 'growth', 'days_to_full', 'samples' }
+		'days_to_full' is None if there is no limit or the use is not growing. """
+
+		since_day = datetime.date.today().toordinal() - days
+		history = self.load(dir_name, kind, method, since_day)
+
+		if kind == "groups":
+			name_field = 'group'
+			lookup = get_groupname
+		else:
+			name_field = 'username'
+			lookup = get_username
+
+		reports = []
+		for owner, owner_days in history.items():
+			name = lookup(owner)
+			if not name:
+				name = str(owner)
+			if names and name not in names:
+				continue
+			points = [(day, owner_days[day][0]) for day in sorted(owner_days.keys())]
+			kbytes, limit, files = owner_days[points[-1][0]]
+			growth = self.growth(points)
+			days_to_full = None
+			if limit > 0 and growth > 0:
+				days_to_full = max(limit - kbytes, 0) / growth
+			reports.append({
+				name_field : name,
+				'dirname' : dir_name,
+				'quota' : kbytes,
+				'limit' : limit,
+				'growth' : growth,
+				'days_to_full' : days_to_full,
+				'samples' : len(points),
+			})
+		return reports
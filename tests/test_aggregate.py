@@ -0,0 +1,115 @@
+"""
+Simple Slurm Tools
+Copyright (C) 2024 John Snowdon
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.aggregate import JobAggregator, JobSampler, ALL, SPILL_RUNS_MAX, VALUE_SIZE
+
+####################################################################
+#
+# Tests for the single pass job aggregation used by shistory.
+#
+####################################################################
+
+def make_jobs(count = 1000, seed = 1):
+	""" Random job records, with the fields the metrics are taken from """
+
+	rand = random.Random(seed)
+	jobs = []
+	for i in range(count):
+		jobs.append({
+			'User' : rand.choice(["bob", "fred", "jen"]),
+			'Account' : rand.choice(["acc1", "acc2"]),
+			'Partition' : "defq",
+			'QOS' : "normal",
+			'ElapsedTime' : rand.random() * 1000,
+			'SubmitMinutes' : rand.randint(0, 5000),
+			'AllocCPUS' : rand.randint(1, 64),
+			'AllocNodes' : rand.randint(1, 4),
+			'MemoryPerCore' : rand.randint(100, 8000),
+		})
+	return jobs
+
+class TestJobAggregator(unittest.TestCase):
+
+	def test_figures(self):
+		jobs = make_jobs(100)
+		aggregator = JobAggregator([('User',)], 75)
+		aggregator.add_jobs(jobs)
+		results = aggregator.results()
+		runtimes = sorted(j['ElapsedTime'] for j in jobs)
+		self.assertEqual(results[ALL]['jobs'], 100)
+		self.assertEqual(results[ALL]['runtime']['min'], runtimes[0])
+		self.assertEqual(results[ALL]['runtime']['max'], runtimes[-1])
+		self.assertAlmostEqual(results[ALL]['runtime']['total'], sum(runtimes))
+		users = results['by_group'][('User',)]
+		self.assertEqual(sum(u['jobs'] for u in users.values()), 100)
+
+	def test_spilled_runs_match(self):
+		jobs = make_jobs(5000)
+		dimensions = [('User',), ('Account', 'User')]
+		unbounded = JobAggregator(dimensions, 75)
+		unbounded.add_jobs(jobs)
+
+		# A budget of a few hundred values spills far more than
+		# SPILL_RUNS_MAX runs, so they are compacted along the way
+		bounded = JobAggregator(dimensions, 75, memory_budget = 300 * VALUE_SIZE)
+		bounded.add_jobs(jobs)
+		try:
+			self.assertLess(len(bounded.runs), SPILL_RUNS_MAX)
+			self.assertEqual(bounded.results(), unbounded.results())
+		finally:
+			bounded.close()
+
+class TestJobSampler(unittest.TestCase):
+
+	def setUp(self):
+		# Rows are indexes into a list of jobs, anything else is unparseable
+		self.jobs = make_jobs(500)
+		self.parse_row = lambda line: self.jobs[line] if isinstance(line, int) else False
+
+	def test_unparseable_rows(self):
+		sampler = JobSampler([('User',)], 75, parse_row = self.parse_row, sample_size = 50)
+		sampler.add_rows(["bad"] + list(range(len(self.jobs))) + ["", None])
+		results = sampler.results()
+		self.assertEqual(sampler.total_jobs, len(self.jobs))
+		self.assertEqual(results[ALL]['jobs'], len(self.jobs))
+		self.assertEqual(results[ALL]['sampled'], 50)
+		for user, r in results['by_group'][('User',)].items():
+			self.assertEqual(r['jobs'], len([j for j in self.jobs if j['User'] == user]))
+			self.assertLessEqual(r['sampled'], 50)
+
+	def test_whole_sample_is_exact(self):
+		sampler = JobSampler([('User',)], 75, parse_row = self.parse_row, sample_size = len(self.jobs))
+		sampler.add_rows(range(len(self.jobs)))
+		aggregator = JobAggregator([('User',)], 75)
+		aggregator.add_jobs(self.jobs)
+		estimate = sampler.results()[ALL]['runtime']
+		exact = aggregator.results()[ALL]['runtime']
+		for figure in ['min', 'max', 'custom']:
+			self.assertEqual(estimate[figure], exact[figure])
+		self.assertAlmostEqual(estimate['total'], exact['total'])
+		self.assertEqual(estimate['mean_ci'], 0)
+		self.assertEqual(estimate['custom_low'], estimate['custom_high'])
+
+if __name__ == "__main__":
+	unittest.main()
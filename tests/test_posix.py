@@ -0,0 +1,232 @@
+"""
+Simple Slurm Tools
+Copyright (C) 2024 John Snowdon
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lib.settings as settings
+from lib.posix import decode_repquota, decode_lfs_quota, read_inventory, read_inventory_dirs, walk_dirs
+from lib.posix import scan_utilisation
+
+####################################################################
+#
+# Tests for the quota and filesystem helpers in lib/posix.py.
+#
+####################################################################
+
+REPQUOTA_OUTPUT = b"""*** Report for user quotas on device /dev/sdb1
+Block grace time: 7days; Inode grace time: 7days
+                        Block limits                File limits
+User            used    soft    hard  grace    used  soft  hard  grace
+----------------------------------------------------------------------
+root      --      20       0       0              2     0     0
+bob       +-  900000  800000 1000000  6days     100     0     0
+fred      --    5000*  4000    6000            10     0     0
+#1234     --      12       0       0              1     0     0
+
+"""
+
+# find DIR -printf '%y|%U|%G|%s|%b|%T@|%A@|%p\n'
+INVENTORY = b"""d|0|0|4096|8|1700000000.0|1700000000.0|/data
+d|0|0|4096|8|1700000000.0|1700000000.0|/data/team1
+f|1000|100|1024|2|1700000000.0|1700000000.0|/data/team1/a
+f|1001|100|2048|4|1700000000.0|1700000000.0|/data/team1/sub/b
+d|0|0|4096|8|1700000000.0|1700000000.0|/data/team2
+f|1000|200|4096|8|1700000000.0|1700000000.0|/data/team2/c
+f|1000|200|512|1|1700000000.0|1700000000.0|/data/team20/d
+not an inventory line
+"""
+
+class TestDecodeRepquota(unittest.TestCase):
+
+	def test_users(self):
+		quotas = decode_repquota(REPQUOTA_OUTPUT, False, "/home")
+		self.assertEqual(sorted(quotas.keys()), ["#1234", "bob", "fred", "root"])
+		self.assertEqual(quotas['root'], { 'username' : "root", 'dirname' : "/home", 'quota' : 20, 'limit' : 0, 'overquota' : False })
+		self.assertEqual(quotas['bob']['quota'], 900000)
+		self.assertEqual(quotas['bob']['limit'], 800000)
+		self.assertTrue(quotas['bob']['overquota'])
+
+	def test_over_quota_marker(self):
+		quotas = decode_repquota(REPQUOTA_OUTPUT, False, "/home")
+		self.assertEqual(quotas['fred']['quota'], 5000)
+		self.assertEqual(quotas['fred']['limit'], 4000)
+		self.assertTrue(quotas['fred']['overquota'])
+
+	def test_groups(self):
+		quotas = decode_repquota(REPQUOTA_OUTPUT.replace(b"User ", b"Group"), True, "/home")
+		self.assertEqual(quotas['bob']['group'], "bob")
+		self.assertNotIn('username', quotas['bob'])
+
+	def test_empty(self):
+		self.assertEqual(decode_repquota(b"", False, "/home"), {})
+
+class TestDecodeLfsQuota(unittest.TestCase):
+
+	def new_data(self):
+		return { 'username' : "bob", 'dirname' : "/lustre/", 'quota' : 0, 'limit' : 0, 'overquota' : False }
+
+	def test_one_line(self):
+		output = b"        /lustre   1234  1000  2000  -  12  0  0  -\n"
+		data = decode_lfs_quota(output, self.new_data())
+		self.assertEqual((data['quota'], data['limit'], data['overquota']), (1234, 1000, False))
+
+	def test_wrapped_path(self):
+		output = b"/a/much/longer/lustre/path\n       1234*  1000  2000  6d  12  0  0  -\n"
+		data = decode_lfs_quota(output, self.new_data())
+		self.assertEqual((data['quota'], data['limit'], data['overquota']), (1234, 1000, True))
+
+	def test_no_figures(self):
+		data = decode_lfs_quota(b"/lustre\n", self.new_data())
+		self.assertEqual((data['quota'], data['limit']), (0, 0))
+
+class TestReadInventory(unittest.TestCase):
+
+	def setUp(self):
+		self.inventory = tempfile.NamedTemporaryFile(suffix = ".txt", delete = False)
+		self.inventory.write(INVENTORY)
+		self.inventory.close()
+
+	def tearDown(self):
+		os.unlink(self.inventory.name)
+
+	def test_whole_file(self):
+		scan = read_inventory(self.inventory.name, "/", "find")
+		self.assertEqual(scan['files'], 7)
+		self.assertEqual(scan['errors'], 1)
+		self.assertEqual(scan['users'][1000]['bytes'], 1024 + 4096 + 512)
+		self.assertEqual(scan['users'][1000]['blocks'], (2 + 8 + 1) * 512)
+		self.assertIsNotNone(scan['age_buckets'])
+
+	def test_prefix(self):
+		scan = read_inventory(self.inventory.name, "/data/team2/", "find")
+		# The folder itself, but not /data/team20
+		self.assertEqual(scan['files'], 2)
+		self.assertEqual(scan['users'][1000]['bytes'], 4096)
+		self.assertEqual(scan['groups'][200]['files'], 1)
+
+	def test_tree(self):
+		scan = read_inventory(self.inventory.name, "/data/team1", "find", tree_depth = 1)
+		self.assertEqual(scan['tree']['sub']['users'][1001], [2048, 4 * 512, 1])
+
+	def test_workers(self):
+		for dir_name in ["/", "/data/team1", "/data/team2"]:
+			one = read_inventory(self.inventory.name, dir_name, "find", workers = 1)
+			many = read_inventory(self.inventory.name, dir_name, "find", workers = 3)
+			self.assertEqual(one, many)
+
+	def test_dirs(self):
+		dir_names = ["/data/team1", "/data/team2", "/data"]
+		scans = read_inventory_dirs(self.inventory.name, dir_names, "find", workers = 2)
+		for dir_name in dir_names:
+			self.assertEqual(scans[dir_name], read_inventory(self.inventory.name, dir_name, "find"))
+
+	def test_unknown_layout(self):
+		self.assertFalse(read_inventory(self.inventory.name, "/", "nosuchlayout"))
+
+class TestWalkDirs(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		for i in range(5):
+			for j in range(4):
+				os.makedirs(os.path.join(self.tmp.name, "d%s" % i, "s%s" % j))
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def new_state(self):
+		return { 'dirs' : [] }
+
+	def process_dir(self, state, dir_name):
+		state['dirs'].append(dir_name)
+		return [e.path for e in os.scandir(dir_name) if e.is_dir()]
+
+	def test_visits_every_dir(self):
+		for workers in [1, 4]:
+			states = walk_dirs(self.tmp.name, self.new_state, self.process_dir, workers)
+			self.assertEqual(len(states), workers)
+			visited = [d for state in states for d in state['dirs']]
+			self.assertEqual(len(visited), 1 + 5 + (5 * 4))
+			self.assertEqual(len(set(visited)), len(visited))
+
+	def test_error_is_raised(self):
+		# A failing directory must not stop its worker, or the walk would
+		# never finish
+		def process_dir(state, dir_name):
+			if os.path.basename(dir_name) == "s1":
+				raise ValueError(dir_name)
+			return self.process_dir(state, dir_name)
+
+		with self.assertRaises(ValueError):
+			walk_dirs(self.tmp.name, self.new_state, process_dir, 2)
+
+class TestScanIndex(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.cache_path = settings.CACHE_PATH
+		settings.CACHE_PATH = os.path.join(self.tmp.name, "cache")
+		self.top = os.path.join(self.tmp.name, "fs")
+		for d in ["a", "a/b", "c"]:
+			os.makedirs(os.path.join(self.top, d))
+			with open(os.path.join(self.top, d, "file"), "wb") as f:
+				f.write(b"x" * 1000)
+		self.age_dirs()
+
+	def tearDown(self):
+		settings.CACHE_PATH = self.cache_path
+		self.tmp.cleanup()
+
+	def age_dirs(self):
+		# The mtime of a directory changed during a scan is not trusted, so
+		# make every directory look as if it last changed a day ago
+		t = time.time_ns() - (86400 * 1000000000)
+		for dir_name, subdirs, files in os.walk(self.top):
+			os.utime(dir_name, ns = (t, t))
+
+	def assertSameTotals(self, scan):
+		full = scan_utilisation(self.top)
+		for key in ['users', 'groups', 'bytes', 'blocks', 'files']:
+			self.assertEqual(scan[key], full[key])
+
+	def test_rescan(self):
+		first = scan_utilisation(self.top, index = True)
+		self.assertEqual(first['dirs_rescanned'], 4)
+		self.assertSameTotals(first)
+
+		again = scan_utilisation(self.top, index = True, workers = 2)
+		self.assertEqual((again['dirs_rescanned'], again['dirs_reused']), (0, 4))
+		self.assertSameTotals(again)
+
+		# Only the changed directory is listed again
+		with open(os.path.join(self.top, "a", "b", "new"), "wb") as f:
+			f.write(b"x" * 5000)
+		t = time.time_ns() - (3600 * 1000000000)
+		os.utime(os.path.join(self.top, "a", "b"), ns = (t, t))
+		changed = scan_utilisation(self.top, index = True)
+		self.assertEqual((changed['dirs_rescanned'], changed['dirs_reused']), (1, 3))
+		self.assertEqual(changed['files'], first['files'] + 1)
+		self.assertSameTotals(changed)
+
+if __name__ == "__main__":
+	unittest.main()
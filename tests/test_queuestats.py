@@ -0,0 +1,101 @@
+"""
+Simple Slurm Tools
+Copyright (C) 2024 John Snowdon
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.queuestats import QueueStats, job_epoch, HEAP_SLACK
+
+####################################################################
+#
+# Tests for the running queue summary used by sjobs watch mode.
+#
+####################################################################
+
+NOW = 1700000000
+
+def make_job(user = "bob", state = "R", cpus = 1, memory = 1000, minutes = 10):
+	""" A job record with the fields the queue summary is taken from """
+	return {
+		'User' : user,
+		'StateCode' : state,
+		'AllocCPUS' : cpus,
+		'TotalMemory' : memory * cpus,
+		'MemoryPerCore' : memory,
+		'ElapsedTime' : minutes,
+		'SubmitMinutes' : minutes,
+	}
+
+class TestQueueStats(unittest.TestCase):
+
+	def add(self, stats, job):
+		stats.add(job, job_epoch(job, NOW))
+
+	def remove(self, stats, job):
+		stats.remove(job, job_epoch(job, NOW))
+
+	def test_add_jobs(self):
+		stats = QueueStats()
+		self.add(stats, make_job("bob", cpus = 4, minutes = 30))
+		self.add(stats, make_job("fred", cpus = 2, minutes = 10))
+		self.add(stats, make_job("fred", state = "PD", cpus = 8, minutes = 5))
+		summary = stats.summary(NOW)
+		self.assertEqual(summary['R']['jobs'], 2)
+		self.assertEqual(summary['R']['users'], 2)
+		self.assertEqual(summary['R']['cores'], { 'sum' : 6, 'max' : 4, 'mean' : 3 })
+		self.assertEqual(summary['R']['time'], { 'sum' : 40, 'max' : 30, 'mean' : 20 })
+		self.assertEqual(summary['PD']['jobs'], 1)
+		self.assertEqual(summary['PD']['cores']['max'], 8)
+
+	def test_max_after_removal(self):
+		stats = QueueStats()
+		big = make_job("bob", cpus = 16, memory = 4000, minutes = 60)
+		small = make_job("fred", cpus = 2, minutes = 5)
+		self.add(stats, big)
+		self.add(stats, small)
+		self.remove(stats, big)
+		summary = stats.summary(NOW)
+		self.assertEqual(summary['R']['jobs'], 1)
+		self.assertEqual(summary['R']['users'], 1)
+		self.assertEqual(summary['R']['cores']['max'], 2)
+		self.assertEqual(summary['R']['ramcore']['max'], 1000)
+		self.assertEqual(summary['R']['time']['max'], 5)
+
+		self.remove(stats, small)
+		summary = stats.summary(NOW)
+		self.assertEqual(summary['R']['jobs'], 0)
+		self.assertEqual(summary['R']['cores']['max'], 0)
+
+	def test_heap_stays_bounded(self):
+		# Values which come and go without ever reaching the top of the
+		# heap must not make it grow without limit
+		stats = QueueStats()
+		self.add(stats, make_job(cpus = 1000, minutes = 1000))
+		for i in range(5000):
+			job = make_job("fred", cpus = (i % 50) + 1, minutes = i)
+			self.add(stats, job)
+			self.remove(stats, job)
+		t = stats.totals['R']
+		for metric, heap in t['heaps'].items():
+			self.assertLessEqual(len(heap), (2 * len(t['counts'][metric])) + HEAP_SLACK + 1)
+		self.assertEqual(stats.summary(NOW)['R']['cores']['max'], 1000)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,98 @@
+"""
+Simple Slurm Tools
+Copyright (C) 2024 John Snowdon
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.slurmjob import SlurmJob
+
+####################################################################
+#
+# Tests for mapping live queue rows from squeue into job records.
+#
+####################################################################
+
+def squeue_row(elapsed = "12:34", nodes = "node[01-02]", memory = "4000M", state = "RUNNING", submit = None, cpus = 8, node_count = 2, tres = None):
+	""" One row of squeue output, in SQUEUE_FORMAT order """
+
+	if submit is None:
+		submit = datetime.datetime.now() - datetime.timedelta(minutes = 10)
+	if tres is None:
+		tres = f"cpu={cpus},mem=8000M,node={node_count},billing={cpus}"
+	fields = ["bob", "acct", str(cpus), str(node_count), elapsed, "123", nodes, "default", "None", memory, submit.strftime('%Y-%m-%dT%H:%M:%S'), state, "normal", tres]
+	return "|".join(fields).encode()
+
+class TestSetSqueueRow(unittest.TestCase):
+
+	def setUp(self):
+		self.sj = SlurmJob()
+
+	def test_running_job(self):
+		job = self.sj.set_squeue_row(squeue_row())
+		self.assertEqual(job['User'], "bob")
+		self.assertEqual(job['JobID'], "123")
+		self.assertEqual(job['AllocCPUS'], 8)
+		self.assertEqual(job['AllocNodes'], 2)
+		self.assertEqual(job['StateCode'], "R")
+		self.assertEqual(job['End'], "Unknown")
+
+	def test_elapsed_formats(self):
+		# squeue drops the hours for jobs under an hour
+		self.assertAlmostEqual(self.sj.set_squeue_row(squeue_row(elapsed = "12:30"))['ElapsedTime'], 12.5)
+		self.assertAlmostEqual(self.sj.set_squeue_row(squeue_row(elapsed = "2:00:00"))['ElapsedTime'], 120)
+		self.assertAlmostEqual(self.sj.set_squeue_row(squeue_row(elapsed = "1-00:00:00"))['ElapsedTime'], 1440)
+		job = self.sj.set_squeue_row(squeue_row(elapsed = "1:00"))
+		self.assertEqual(job['CPUTimeRaw'], 8 * 60)
+
+	def test_pending_job(self):
+		job = self.sj.set_squeue_row(squeue_row(elapsed = "0:00", nodes = "", state = "PENDING", cpus = 4, node_count = 1))
+		self.assertEqual(job['StateCode'], "PD")
+		self.assertEqual(job['NodeList'], "")
+		self.assertEqual(job['ReqCPUS'], 4)
+		self.assertEqual(job['ElapsedTime'], 0)
+
+	def test_memory_per_node(self):
+		# --mem=4000M on each of 2 nodes
+		job = self.sj.set_squeue_row(squeue_row(memory = "4000M", tres = "cpu=8,mem=8000M,node=2"))
+		self.assertEqual(job['ReqMem'], "4000Mn")
+		self.assertEqual(job['MemoryPerCore'], 1000)
+		self.assertEqual(job['TotalMemory'], 8000)
+		job = self.sj.set_squeue_row(squeue_row(memory = "8G", cpus = 4, node_count = 1, tres = "cpu=4,mem=8G,node=1"))
+		self.assertEqual(job['MemoryPerCore'], 2048)
+
+	def test_memory_per_cpu(self):
+		# --mem-per-cpu=2000M; squeue shows the same bare 2000M as MinMemory
+		job = self.sj.set_squeue_row(squeue_row(memory = "2000M", tres = "cpu=8,mem=16000M,node=2"))
+		self.assertEqual(job['MemoryPerCore'], 2000)
+		self.assertEqual(job['TotalMemory'], 16000)
+
+	def test_memory_not_tracked(self):
+		job = self.sj.set_squeue_row(squeue_row(tres = "cpu=8,node=2"))
+		self.assertEqual(job['ReqMem'], "")
+		self.assertEqual(job['TotalMemory'], 0)
+
+	def test_submit_minutes_past_a_day(self):
+		submit = datetime.datetime.now() - datetime.timedelta(days = 2, minutes = 30)
+		job = self.sj.set_squeue_row(squeue_row(submit = submit))
+		self.assertAlmostEqual(job['SubmitMinutes'], (2 * 1440) + 30, delta = 1)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,88 @@
+"""
+Simple Slurm Tools
+Copyright (C) 2024 John Snowdon
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.usagehistory import UsageHistory
+
+####################################################################
+#
+# Tests for the disk use history behind diskrep -trend.
+#
+####################################################################
+
+class TestUsageHistory(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.history = UsageHistory(os.path.join(self.tmp.name, "cache"))
+		self.today = datetime.date.today()
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def store_days(self, days = 10, start = 1000, growth = 100, limit = 2000):
+		""" One record a day for root, growing steadily, up to today """
+		for i in range(days):
+			day = self.today - datetime.timedelta(days = days - 1 - i)
+			report = { 'username' : "root", 'quota' : start + (growth * i), 'limit' : limit }
+			self.history.store("/data", "users", "find", [report], day)
+
+	def test_store_and_load(self):
+		self.store_days()
+		reports = [
+			{ 'username' : "root", 'quota' : 5, 'limit' : 0, 'files' : 3 },
+			{ 'username' : "no-such-user-here", 'quota' : 5, 'limit' : 0 },
+		]
+		# Only owners with an id are recorded, and the later record for
+		# a day replaces the earlier one
+		self.assertEqual(self.history.store("/data", "users", "find", reports), 1)
+		history = self.history.load("/data", "users", "find")
+		self.assertEqual(len(history[0]), 10)
+		self.assertEqual(history[0][self.today.toordinal()], (5, 0, 3))
+
+		since = self.history.load("/data", "users", "find", self.today.toordinal() - 2)
+		self.assertEqual(sorted(since[0].keys()), [self.today.toordinal() - d for d in [2, 1, 0]])
+		self.assertEqual(self.history.load("/data", "users", "quota"), {})
+
+	def test_trend(self):
+		self.store_days()
+		reports = self.history.trend("/data", "users", "find", days = 30)
+		self.assertEqual(len(reports), 1)
+		r = reports[0]
+		self.assertEqual((r['username'], r['quota'], r['limit'], r['samples']), ("root", 1900, 2000, 10))
+		self.assertAlmostEqual(r['growth'], 100)
+		self.assertAlmostEqual(r['days_to_full'], 1)
+
+		# Only the days within the trend period are used
+		self.assertEqual(self.history.trend("/data", "users", "find", days = 4)[0]['samples'], 5)
+		self.assertEqual(self.history.trend("/data", "users", "find", names = ["bob"]), [])
+
+	def test_not_growing(self):
+		self.store_days(growth = 0)
+		r = self.history.trend("/data", "users", "find")[0]
+		self.assertEqual(r['growth'], 0)
+		self.assertIsNone(r['days_to_full'])
+
+if __name__ == "__main__":
+	unittest.main()